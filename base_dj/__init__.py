@@ -2,3 +2,8 @@ from . import models
 from . import controllers
 from . import wizards
 from .patch import patch_fields
+from .models.ir.ir_translation import drop_translation_trigger
+
+
+def uninstall_hook(cr, registry):
+    drop_translation_trigger(cr)
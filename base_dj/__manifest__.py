@@ -16,7 +16,7 @@
     ],
     'external_dependencies': {
         'python': [
-            'autopep8',
+            'pycodestyle',  # tests only too
             'pylint',  # this one is just for tests indeed
             'unicodecsv',
         ]
@@ -25,6 +25,8 @@
         'security/ir.model.access.csv',
         'data/equalizer.xml',
         'data/export_compilation.xml',
+        'data/burn_job_cron.xml',
+        'data/id_set_cron.xml',
         'wizards/burn_wiz.xml',
         'wizards/burn_selected_wiz.xml',
         'wizards/load_compilation.xml',
@@ -32,10 +34,13 @@
         'views/compilation.xml',
         'views/song.xml',
         'views/equalizer.xml',
+        'views/track_cache.xml',
+        'views/burn_job.xml',
         'views/menuitems.xml',
         'views/info_templates.xml',
     ],
     'installable': True,
     'auto_install': False,
     'post_load': 'patch_fields',
+    'uninstall_hook': 'uninstall_hook',
 }
@@ -2,6 +2,7 @@
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl)
 
 from odoo import models, _
+import zipfile
 
 SPECIAL_FIELDS = [
     'display_name',
@@ -19,6 +20,17 @@ SPECIAL_FIELDS = [
     'website_message_ids',
 ] + models.MAGIC_COLUMNS
 
+# ctx keys holding objects or flags that live for a whole burn.
+# They must not be propagated outside of it (eg: download urls).
+BURN_STATE_CTX_KEYS = (
+    'dj_xid_resolver',
+    'dj_burn_summary',
+    'dj_burn_progress',
+    'dj_layouts',
+    'dj_delta_manifests',
+    'dj_id_sets',
+)
+
 ADDONS_BLACKLIST = (
     # useless to track these modules amongst installed addons
     # TODO: anything else to ignore?
@@ -124,6 +136,78 @@ SONG_TYPES = {
     },
 }
 
+# records handled at once by `generate_xmlids` songs
+XMLID_CHUNK_SIZE = 5000
+
+# default length of hashes for `short_hash` xmlid policy
+XMLID_HASH_LENGTH = 8
+
+# records exported at once: cache is cleared after each batch
+EXPORT_BATCH_SIZE = 1000
+
+# temporary files are kept in memory up to this size (bytes)
+SPOOL_MAX_SIZE = 10 * 1024 * 1024
+
+# name of songs' attachment holding delta burns baseline
+DELTA_MANIFEST_NAME = 'dj_delta_manifest.json'
+
+# zip entries compression `(compress type, level)`
+# by file extension, mimetype or main mimetype.
+# Media already compressed are stored as they are.
+ZIP_COMPRESSION_LEVEL = 6
+ZIP_DEFLATED = (zipfile.ZIP_DEFLATED, ZIP_COMPRESSION_LEVEL)
+ZIP_STORED = (zipfile.ZIP_STORED, None)
+ZIP_COMPRESSION = {
+    '.csv': ZIP_DEFLATED,
+    '.py': ZIP_DEFLATED,
+    '.png': ZIP_STORED,
+    '.jpg': ZIP_STORED,
+    '.jpeg': ZIP_STORED,
+    '.gif': ZIP_STORED,
+    '.webp': ZIP_STORED,
+    '.zip': ZIP_STORED,
+    '.gz': ZIP_STORED,
+    '.bz2': ZIP_STORED,
+    '.xz': ZIP_STORED,
+    '.woff': ZIP_STORED,
+    '.woff2': ZIP_STORED,
+    '.docx': ZIP_STORED,
+    '.xlsx': ZIP_STORED,
+    '.odt': ZIP_STORED,
+    '.ods': ZIP_STORED,
+    'image/svg+xml': ZIP_DEFLATED,
+    'image/bmp': ZIP_DEFLATED,
+    'image': ZIP_STORED,
+    'audio': ZIP_STORED,
+    'video': ZIP_STORED,
+}
+ZIP_COMPRESSION_DEFAULT = ZIP_DEFLATED
+
+# files burnt into a directory by a set of compilations,
+# see `Compilation.burn_to_directory`
+BURN_MANIFEST_PATH = '.dj/{name}.manifest'
+
+# max processes burning songs in parallel (burn jobs only)
+BURN_WORKERS_MAX = 8
+
+# running burn jobs hold this advisory lock (w/ their ID) until done.
+# Running jobs w/out lock started before the timeout (seconds)
+# have been interrupted (eg: restart): they are marked as failed.
+BURN_JOB_LOCK_KEY = 20171
+BURN_JOB_STALE_TIMEOUT = 10 * 60
+
+# ids lists longer than this are searched via sub-selects
+# (see `dj.id.set`) and unused sets are dropped after max age (seconds)
+ID_SET_THRESHOLD = 1000
+ID_SET_MAX_AGE = 24 * 3600
+# prefix of the set keys stored into songs' domains instead of big lists
+ID_SET_REF = 'dj_id_set:'
+
+# default max size of burnt tracks cache (bytes)
+# and system parameter overriding it
+TRACK_CACHE_MAX_SIZE = 1024 * 1024 * 1024
+TRACK_CACHE_MAX_SIZE_PARAM = 'base_dj.track_cache_max_size'
+
 DEFAULT_PYTHON_CODE = """# Available variable:
 #  - env: Odoo Environement
 # You have to return a recordset named `records`.
@@ -3,19 +3,24 @@
 
 from odoo import http
 from odoo.http import request
+from werkzeug.wsgi import wrap_file
 import os
 import mimetypes
+import tempfile
 from ..utils import string_to_list
+from ..config import SPOOL_MAX_SIZE
 
 
 class DJ(http.Controller):
     """Controller for dj tools."""
 
-    def _make_download_headers(self, data, filename, content_type):
+    def _make_download_headers(self, data, filename, content_type, size=None):
+        if size is None:
+            size = len(data)
         return [
             ('Content-Disposition', 'attachment; filename=%s' % filename),
             ('Content-Type', '%s; charset=utf-8' % content_type),
-            ('Content-Length', "%d" % len(data)),
+            ('Content-Length', "%d" % size),
             ('Pragma', "no-cache"),
             ('Cache-Control',
              'must-revalidate, \
@@ -50,7 +55,37 @@ class DJ(http.Controller):
         ids = string_to_list(compilation_ids, modifier=int)
         records = request.env['dj.compilation'].browse(ids)
         ctx = request.env['dj.compilation'].make_burn_ctx_via_params(**kwargs)
-        filename, content = records.with_context(**ctx).burn()
+        # zip is spooled to disk when big and streamed from there
+        fp = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+        try:
+            filename = records.with_context(**ctx).burn_to_file(fp)
+            fp.seek(0, os.SEEK_END)
+            size = fp.tell()
+            fp.seek(0)
+        except Exception:
+            fp.close()
+            raise
         headers = self._make_download_headers(
-            content, filename, 'application/zip')
-        return request.make_response(content, headers=headers)
+            None, filename, 'application/zip', size=size)
+        # file is closed by the wrapper once sent
+        return http.Response(
+            wrap_file(request.httprequest.environ, fp),
+            headers=headers, direct_passthrough=True)
+
+    @http.route(
+        '/dj/download/attachment/<int:attachment_id>',
+        type='http', auth="user", website=False)
+    def download_attachment(self, attachment_id, **kwargs):
+        """Stream burnt files stored as attachments (see `BurnWiz`)."""
+        attachment = request.env['ir.attachment'].browse(attachment_id)
+        attachment.check('read')
+        attachment = attachment.sudo()
+        if not attachment.exists():
+            return request.not_found()
+        headers = self._make_download_headers(
+            None, attachment.datas_fname or attachment.name,
+            attachment.mimetype or 'application/octet-stream',
+            size=attachment.file_size)
+        return http.Response(
+            wrap_file(request.httprequest.environ, attachment.dj_open()),
+            headers=headers, direct_passthrough=True)
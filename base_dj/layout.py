@@ -0,0 +1,79 @@
+# Copyright 2017 Camptocamp SA
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl)
+
+import os
+import string
+from collections import Counter
+
+from .utils import to_str
+
+
+def disc_path_fields(pattern):
+    """Return names of compilation fields used by `pattern`."""
+    names = set()
+    for __, field_name, __, __ in string.Formatter().parse(pattern):
+        if field_name:
+            names.add(field_name.split('.')[0].split('[')[0])
+    return list(names)
+
+
+class CompilationLayout(object):
+    """Positions, names and paths of the songs of a compilation.
+
+    Computed once for all songs instead of scanning the compilation
+    for each of them. Only plain data is kept: layouts are shared
+    w/ burn workers too.
+    """
+
+    def __init__(self, compilation):
+        # `compilation` is empty for songs not assigned yet
+        songs = compilation.song_ids
+        self.positions = {song.id: i for i, song in enumerate(songs, 1)}
+        self.counts = Counter(song._song_model_count_key for song in songs)
+        self.disc_full_path = ''
+        if compilation:
+            fnames = disc_path_fields(compilation.disc_path)
+            values = compilation.read(fnames)[0] if fnames else {}
+            self.disc_full_path = to_str(
+                compilation.disc_path.format_map(values))
+        self.anthem_module = self.disc_full_path.replace(
+            '/', '.').replace('.py', '')
+        self.path_data = {
+            'data_mode': compilation.data_mode,
+            'genre': compilation.genre_id.name,
+            'comp_name': compilation.name,
+        }
+
+    def position(self, song):
+        return self.positions.get(song.id) or song._scan_position()
+
+    def is_shared(self, song):
+        """Tell if `song` shares model and type w/ other songs."""
+        return self.counts[song._song_model_count_key] > 1
+
+    def song_name(self, song):
+        name = song._base_name()
+        if self.is_shared(song):
+            # make name unique in the compilation
+            name += '_%d' % self.position(song)
+        if song.export_lang:
+            name += '_' + song.export_lang
+        return name
+
+    def real_path(self, song, pattern):
+        path = pattern.format(model=song.song_model._name, **self.path_data)
+        if self.is_shared(song):
+            # make filename unique. Include position to match song name
+            path, ext = os.path.splitext(path)
+            path += '_%d' % self.position(song)
+            path += ext
+        return path
+
+    def csv_path(self, song):
+        return self.real_path(song, song.csv_path)
+
+    def binaries_path(self, song):
+        return self.real_path(song, song.binaries_path)
+
+    def anthem_path(self, name='main'):
+        return '{}::{}'.format(self.anthem_module, name)
@@ -1,19 +1,26 @@
 # Copyright 2017 Camptocamp SA
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
 
-from psycopg2 import IntegrityError
 from odoo import api, models, tools, _
-from odoo.exceptions import ValidationError
-import io
+from odoo.exceptions import UserError, ValidationError
 import os
 import codecs
+import csv
 import logging
 import mimetypes
 import hashlib
-import uuid
-
-from ..utils import is_xml, to_str, is_string, follow_record_field
+from collections import defaultdict
+
+from ..utils import (
+    is_xml,
+    to_str,
+    is_string,
+    follow_record_field,
+    CSVLineEndingsWriter,
+)
 from ..slugifier import slugify
+from ..xmlid import XMLIDWriter, XMLIDConflictError, ShortHashIndex
+from ..config import XMLID_HASH_LENGTH
 
 ODOO_DATA_PATH = os.getenv('ODOO_DATA_PATH', '').rstrip('/')
 _logger = logging.getLogger(__file__)
@@ -34,8 +41,6 @@ class Base(models.AbstractModel):
     @staticmethod
     def _hash_them(atuple):
         """Return always the same hashed string for given tuple."""
-        # TODO: get a shorter but still unique hash
-        # Maybe using `hashids` lib?
         return hashlib.md5(str(atuple).encode()).hexdigest()
 
     def _dj_xmlid_export_module(self):
@@ -46,15 +51,10 @@ class Base(models.AbstractModel):
         """
         return self.env.context.get('dj_xmlid_module') or '__setup__'
 
-    @tools.ormcache('self', 'key')
     def _dj_global_config(self, key=None):
         """Retrieve default global config for xmlid fields."""
-        config = self.env['dj.equalizer'].search([
-            ('model', '=', self._name),
-        ], limit=1)
-        return config.get_conf(key)
+        return self.env['dj.equalizer'].get_model_conf(self._name, key)
 
-    @tools.ormcache('self')
     def _dj_xmlid_export_name(self):
         """Customize xmlid name for dj compilation.
 
@@ -63,55 +63,371 @@ class Base(models.AbstractModel):
         to be used for xmlid generation.
         Strings will be normalized.
         """
-        name = [
-            self._table, str(self.id),
-            uuid.uuid4().hex[:8],
-        ]  # std odoo default
+        return self._dj_xmlid_export_names()[self.id]
+
+    def _dj_xmlid_export_names(self):
+        """Generate dj xmlid names for the whole recordset at once.
+
+        Same rules as `_dj_xmlid_export_name` apply but values
+        are loaded field by field for all the records
+        and normalized values are computed only once.
+
+        Names are cached for the whole burn, if any.
+
+        :return: dictionary {record id: xmlid name}
+        """
         mapping = self.env.context.get('dj_xmlid_fields_map') or {}
         global_config = self._dj_global_config()
-        xmlid_fields = (mapping.get(self._name, []) or
-                        global_config.get('xmlid_fields', []))
+        # copy it: we don't want to alter cached configuration
+        xmlid_fields = list(mapping.get(self._name, []) or
+                            global_config.get('xmlid_fields', []))
         if not xmlid_fields and 'name' in self:
             # No specific configuration: we assume we can use name as default
             xmlid_fields.append('name')
-        if xmlid_fields:
-            name = [self._table, ]
-            if global_config.get('xmlid_table_name'):
-                name = [global_config['xmlid_table_name'], ]
-            xmlid_fields_name = []
-            for key in xmlid_fields:
-                if '.' in key:
-                    val = follow_record_field(self, key)
-                elif self[key]:
-                    val = self[key]
-                else:
-                    continue
-                value = to_str(val, safe=True)
-                if isinstance(value, str):
-                    value = slugify(value).replace('-', '_')
-                elif isinstance(value, models.BaseModel):
-                    value = slugify(value.display_name).replace('-', '_')
-                elif isinstance(value, (int, float)):
-                    value = str(value)
-                xmlid_fields_name.append(value)
-            if global_config.get('xmlid_policy') == 'hash':
-                # sometime this is the only way to get unique xmlids
-                # (ir.default for instance).
-                name.append(self._hash_them(tuple(xmlid_fields_name)))
+        settings = (
+            tuple(xmlid_fields),
+            global_config.get('xmlid_table_name') or self._table,
+            global_config.get('xmlid_policy'),
+            global_config.get('xmlid_hash_length') or XMLID_HASH_LENGTH,
+            bool(self.env.context.get('dj_multicompany') and
+                 'company_id' in self),
+        )
+        resolver = self.env.context.get('dj_xid_resolver')
+        if resolver is None:
+            return self._dj_xmlid_make_names(*settings)
+        cache = resolver.names
+        names = {}
+        todo = []
+        for res_id in self.ids:
+            key = (self._name, res_id, settings)
+            if key in cache:
+                names[res_id] = cache[key]
+            else:
+                todo.append(res_id)
+        if todo:
+            new_names = self.browse(todo)._dj_xmlid_make_names(*settings)
+            for res_id, name in new_names.items():
+                cache[(self._name, res_id, settings)] = name
+            names.update(new_names)
+        return names
+
+    def _dj_xmlid_make_names(self, xmlid_fields, table_name,
+                             xmlid_policy, hash_length, multicompany):
+        """Generate xmlid names for current records w/ given settings."""
+        hash_policy = xmlid_policy in ('hash', 'short_hash')
+        short_hashes = None
+        if xmlid_policy == 'short_hash':
+            resolver = self.env.context.get('dj_xid_resolver')
+            # unique across the whole burn if any
+            short_hashes = resolver.short_hashes if resolver \
+                else ShortHashIndex()
+
+        # load all the values we need in few queries
+        for key in xmlid_fields:
+            self._dj_prefetch_path(key)
+        if multicompany:
+            self.mapped('company_id.aka')
+
+        slugs = {}
+        dbuuid = None
+        if not xmlid_fields:
+            dbuuid = self.env['ir.config_parameter'].sudo().get_param(
+                'database.uuid')
+
+        def normalize(value):
+            if value not in slugs:
+                slugs[value] = slugify(value).replace('-', '_')
+            return slugs[value]
+
+        names = {}
+        for record in self:
+            aka = None
+            if multicompany and record.company_id.aka:
+                aka = record.company_id.normalized_aka()
+            if not xmlid_fields:
+                # same as std odoo default but w/ a stable suffix:
+                # the same record gets always the same name
+                name = [
+                    self._table, str(record.id),
+                    self._dj_xmlid_stable_hash(dbuuid, record.id),
+                ]
             else:
-                name.extend(xmlid_fields_name)
-        if (self.env.context.get('dj_multicompany') and
-                'company_id' in self and self.company_id.aka):
-            # discriminate by company `aka` code
-            name.insert(0, self.company_id.normalized_aka())
-        return '_'.join(name)
+                name = [table_name, ]
+                xmlid_fields_name = []
+                for key in xmlid_fields:
+                    if '.' in key:
+                        val = follow_record_field(record, key)
+                    elif record[key]:
+                        val = record[key]
+                    else:
+                        continue
+                    value = to_str(val, safe=True)
+                    if isinstance(value, str):
+                        value = normalize(value)
+                    elif isinstance(value, models.BaseModel):
+                        value = normalize(value.display_name)
+                    elif isinstance(value, (int, float)):
+                        value = str(value)
+                    xmlid_fields_name.append(value)
+                if hash_policy:
+                    # sometime this is the only way to get unique xmlids
+                    # (ir.default for instance).
+                    digest = self._hash_them(tuple(xmlid_fields_name))
+                    if short_hashes is not None:
+                        prefix = '_'.join(
+                            [x for x in (aka, table_name) if x] + [''])
+                        digest = short_hashes.shorten(
+                            self._name, prefix, digest, hash_length)
+                    name.append(digest)
+                else:
+                    name.extend(xmlid_fields_name)
+            if aka:
+                # discriminate by company `aka` code
+                name.insert(0, aka)
+            names[record.id] = '_'.join(name)
+        return names
+
+    def _dj_xmlid_stable_hash(self, dbuuid, res_id):
+        """Return a short hash unique per database, model and record."""
+        key = '{},{},{}'.format(dbuuid, self._name, res_id)
+        return hashlib.md5(key.encode()).hexdigest()[:8]
+
+    def _dj_prefetch_path(self, path):
+        """Load values of (dotted) field `path` for all records in one go.
+
+        Values land into the cache, hence reading them record by record
+        does not hit the database anymore.
+        """
+        records = self
+        for fname in path.split('.'):
+            field = records._fields.get(fname)
+            if field is None:
+                # let `follow_record_field` complain w/ a proper message
+                return
+            values = records.mapped(fname)
+            if not field.relational:
+                return
+            records = values
+        if '.' not in path:
+            # relations are normalized via their display name
+            records.mapped('display_name')
+
+    def _dj_xmlid_value_records(self, field_names):
+        """Retrieve records referenced by exported values of `field_names`.
+
+        Their xmlids replace the values on export,
+        see `ir.property` and `ir.default`.
+
+        :return: dictionary {model name: set of ids}
+        """
+        return {}
 
     def _dj_export_xmlid(self):
         """Shortcut to force dj xmlid generation on 1 record."""
         self.ensure_one()
+        return self._dj_export_xmlids()[0]
+
+    def _dj_export_xmlids(self):
+        """Shortcut to force dj xmlid generation on the whole recordset.
+
+        :return: list of xmlids following records' order
+        """
         res = self.with_context(dj_export=1)._BaseModel__ensure_xml_id()
         # we get a generator w/ tuple(record, xid)
-        return tuple(res)[0][1]
+        return [xid for __, xid in res]
+
+    # export straight from SQL when songs' fields allow it.
+    # Disable it for models altering values on read.
+    _dj_export_sql_fast_path = True
+    _dj_export_sql_field_types = (
+        'char', 'selection', 'boolean', 'integer', 'many2one',
+    )
+
+    def _dj_export_sql_supported(self, field_names):
+        """Tell if `field_names` can be exported w/ `_dj_export_sql_csv`.
+
+        Only stored columns whose export value does not depend
+        on the ORM (translations, inherited fields, files...) are supported.
+        XMLIDs must be read from the db: forcing or skipping them is not.
+        """
+        ctx = self.env.context
+        if (not self._dj_export_sql_fast_path or
+                not self._is_an_ordinary_table() or
+                ctx.get('dj_xmlid_force') or
+                ctx.get('dj_xmlid_skip_create') or
+                ctx.get('export_raw_data')):
+            return False
+        special = [x[0] for x in self._dj_special_fields()]
+        for path in field_names:
+            if path == 'id':
+                continue
+            fname = path[:-len('/id')] if path.endswith('/id') else path
+            field = self._fields.get(fname)
+            if (field is None or fname in special or
+                    field.type not in self._dj_export_sql_field_types or
+                    not field.store or not field.column_type or
+                    field.inherited or field.translate or
+                    field.company_dependent):
+                return False
+            if field.type == 'many2one':
+                comodel = self.env[field.comodel_name]
+                if (fname == path or
+                        not comodel._is_an_ordinary_table()):
+                    return False
+            elif fname != path:
+                return False
+        return True
+
+    def _dj_export_sql_query(self, field_names):
+        """Build the query exporting current records as `export_data` does.
+
+        Values are formatted as `convert_to_export` does
+        and xmlids are the latest ones, like `_existing_xids` gives them.
+        """
+        columns = []
+        joins = []
+        params = []
+        for i, path in enumerate(field_names):
+            if path == 'id' or path.endswith('/id'):
+                if path == 'id':
+                    col, comodel = 't.id', self._name
+                else:
+                    field = self._fields[path[:-len('/id')]]
+                    col = 't."{}"'.format(field.name)
+                    comodel = field.comodel_name
+                alias = 'x{}'.format(i)
+                joins.append("""
+                    LEFT JOIN LATERAL (
+                        SELECT CASE WHEN module <> ''
+                            THEN module || '.' || name ELSE name END AS xid
+                        FROM ir_model_data
+                        WHERE model = %s AND res_id = {col}
+                        ORDER BY id DESC
+                        LIMIT 1
+                    ) {alias} ON TRUE
+                """.format(col=col, alias=alias))
+                params.append(comodel)
+                columns.append("COALESCE({}.xid, '')".format(alias))
+                continue
+            field = self._fields[path]
+            col = 't."{}"'.format(field.name)
+            if field.type == 'boolean':
+                columns.append(
+                    "CASE WHEN {} THEN 'True' ELSE '' END".format(col))
+            elif field.type == 'integer':
+                columns.append(
+                    "CASE WHEN {0} <> 0 THEN {0}::text ELSE '' END".format(
+                        col))
+            elif field.type == 'char' and field.size:
+                columns.append("COALESCE(left({}, {:d}), '')".format(
+                    col, field.size))
+            else:
+                columns.append("COALESCE({}::text, '')".format(col))
+        query = """
+            SELECT {columns}
+            FROM unnest(%s::int[]) WITH ORDINALITY AS r(id, seq)
+            JOIN "{table}" t ON t.id = r.id
+            {joins}
+            ORDER BY r.seq
+        """.format(
+            columns=', '.join(columns),
+            table=self._table,
+            joins=''.join(joins),
+        )
+        return query, [list(self.ids)] + params
+
+    def _dj_export_sql_csv(self, field_names, fp):
+        """Write CSV rows of current records to binary file object `fp`.
+
+        Same output as `write_csv` w/ `export_data` rows,
+        w/out going through the ORM for each value.
+        See `_dj_export_sql_supported`.
+        """
+        if not self:
+            return
+        # xmlids are read from the db: make sure they are all there
+        self._dj_export_xmlids()
+        for path in field_names:
+            if path.endswith('/id'):
+                self.mapped(path[:-len('/id')])._dj_export_xmlids()
+        # values pending for computation must land into the db
+        self.recompute()
+        query, params = self._dj_export_sql_query(field_names)
+        sql = self.env.cr.mogrify(query, params).decode('utf-8')
+        writer = CSVLineEndingsWriter(fp)
+        self.env.cr.copy_expert(
+            "COPY ({}) TO STDOUT WITH (FORMAT csv, FORCE_QUOTE *)".format(sql),
+            writer)
+        writer.close()
+
+    def _dj_translatable_fields(self, field_names):
+        """Fields among `field_names` whose translations can be bulk read.
+
+        Inherited and special fields are left to the ORM.
+        """
+        special = [x[0] for x in self._dj_special_fields()]
+        res = []
+        for fname in field_names:
+            field = self._fields.get(fname)
+            if (field is None or not field.translate or
+                    not field.store or not field.column_type or
+                    field.inherited or fname in special):
+                continue
+            res.append(field)
+        return res
+
+    def _dj_translated_values(self, field_names, langs):
+        """Read translated values of current records for all `langs` at once.
+
+        Values are the same you get reading records w/ `lang` in context:
+        `model` translations for plain translatable fields,
+        `model_terms` ones for fields translated by terms (html, xml).
+
+        :param field_names: fields to read, see `_dj_translatable_fields`
+        :return: dictionary {lang: {field name: {record id: value}}}
+        """
+        _fields = self._dj_translatable_fields(field_names)
+        res = {lang: {f.name: {} for f in _fields} for lang in langs}
+        if not self or not _fields or not langs:
+            return res
+        cr = self.env.cr
+        # source values
+        cr.execute('SELECT id, {} FROM "{}" WHERE id IN %s'.format(
+            ', '.join('"{}"'.format(f.name) for f in _fields), self._table
+        ), (tuple(self.ids), ))
+        sources = {row[0]: row[1:] for row in cr.fetchall()}
+        cr.execute("""
+            SELECT lang, type, name, res_id, src, value
+            FROM ir_translation
+            WHERE type IN ('model', 'model_terms')
+                AND name IN %s AND lang IN %s AND res_id IN %s
+                AND value != ''
+            ORDER BY id
+        """, (
+            tuple('{},{}'.format(self._name, f.name) for f in _fields),
+            tuple(langs), tuple(self.ids),
+        ))
+        # {(lang, field name, res_id): value}
+        values = {}
+        # {(lang, field name, res_id): {source term: translated term}}
+        terms = defaultdict(dict)
+        for lang, ttype, name, res_id, src, value in cr.fetchall():
+            key = (lang, name.split(',', 1)[1], res_id)
+            if ttype == 'model':
+                values[key] = value
+            else:
+                terms[key][src] = value
+        for lang in langs:
+            for i, field in enumerate(_fields):
+                by_id = res[lang][field.name]
+                for res_id, row in sources.items():
+                    key = (lang, field.name, res_id)
+                    if callable(field.translate):
+                        by_id[res_id] = field.translate(
+                            terms.get(key, {}).get, row[i])
+                    else:
+                        by_id[res_id] = values.get(key, row[i])
+        return res
 
     _dj_replaceable_modnames = (
         '__sample__', '__setup__', '__test__',
@@ -133,11 +449,18 @@ class Base(models.AbstractModel):
 
         So, here we keep the original code, in tests we mock this
         to retrieve XIDs via `env.ref`.
+
+        While burning, XIDs are served by the burn's resolver
+        (see `base_dj.xmlid.XMLIDResolver`) to not query them one by one.
         """
+        resolver = self.env.context.get('dj_xid_resolver')
+        if resolver is not None:
+            return resolver.lookup(self)
         query = """
             SELECT res_id, module, name
             FROM ir_model_data
             WHERE model = %s AND res_id in %s
+            ORDER BY id
         """
         cr = self.env.cr
         cr.execute(query, (self._name, tuple(self.ids)))
@@ -174,13 +497,14 @@ class Base(models.AbstractModel):
             (module, name) = xids[record_id]
             return ('%s.%s' % (module, name)) if module else name
 
-        def make_xid(r):
-            # call `_dj_xmlid_export_name` and keep the context
-            # which is very important for xid policy
-            return r.with_context(self.env.context)._dj_xmlid_export_name()
+        force = self.env.context.get('dj_xmlid_force')
+        # generate names in one shot. The context is very important
+        # for xid policy and we keep it as we work on `self`.
+        # When forcing we must compare all of them w/ existing ones.
+        names = self._dj_xmlid_export_names() if force else {}
 
         def is_missing(r):
-            if not self.env.context.get('dj_xmlid_force'):
+            if not force:
                 return r.id not in xids
             # in case we are re-generating xids
             # replace only xids w/ replaceable mod names
@@ -188,7 +512,7 @@ class Base(models.AbstractModel):
             replaceable = xid_modname in self._dj_replaceable_modnames
             return (
                 not xid_modname or replaceable and
-                to_xid(r.id) != '{}.{}'.format(modname, make_xid(r))
+                to_xid(r.id) != '{}.{}'.format(modname, names[r.id])
             )
 
         # create missing xml ids
@@ -199,34 +523,46 @@ class Base(models.AbstractModel):
                 (record, to_xid(record.id))
                 for record in self
             )
+        if not force:
+            names = missing._dj_xmlid_export_names()
         xids.update(
-            (r.id, (modname, r._dj_xmlid_export_name())) for r in missing
+            (r.id, (modname, names[r.id])) for r in missing
         )
+        resolver = self.env.context.get('dj_xid_resolver')
         # you can generate one shot xids and not store them
         # so you don't pollute your db and maybe fix some csv
         if not self.env.context.get('dj_xmlid_skip_create'):
-            fields = ['module', 'model', 'name', 'res_id']
+            if self.env.context.get('dj_xmlid_readonly'):
+                # parallel burn workers: see `Compilation.burn_prepare`
+                raise UserError(_(
+                    "Missing xmlids for %s cannot be created "
+                    "by parallel burn workers. Burn w/out workers."
+                ) % self._name)
+            writer = XMLIDWriter(
+                self.env.cr,
+                strategy=self.env.context.get('dj_xmlid_conflict') or 'fail',
+            )
             try:
-                self.env.cr.copy_from(io.StringIO(
-                    u'\n'.join(
-                        u"%s\t%s\t%s\t%d" % (
-                            modname,
-                            record._name,
-                            xids[record.id][1],
-                            record.id,
-                        )
-                        for record in missing
-                    )),
-                    table='ir_model_data',
-                    columns=fields,
+                names, report = writer.write(
+                    self._name, modname,
+                    {r.id: xids[r.id][1] for r in missing}
                 )
-            except IntegrityError:
+            except XMLIDConflictError as err:
                 raise ValidationError(_(
                     "Writing xmlids for %s failed."
-                    " Probably your xmlids aren't unique."
-                    " Ids in the query: %s"
-                ) % (self._name, missing.ids))
-            self.env['ir.model.data'].invalidate_cache(fnames=fields)
+                    " Your xmlids aren't unique.\n%s"
+                ) % (self._name, err.report))
+            if report:
+                _logger.warning(report)
+                if resolver is not None:
+                    resolver.reports.append(report)
+            xids.update(
+                (res_id, (modname, name)) for res_id, name in names.items()
+            )
+            self.env['ir.model.data'].invalidate_cache(
+                fnames=['module', 'model', 'name', 'res_id'])
+        if resolver is not None:
+            resolver.update(self._name, {r.id: xids[r.id] for r in missing})
         return (
             (record, to_xid(record.id))
             for record in self
@@ -417,3 +753,22 @@ class Base(models.AbstractModel):
     def create(self, vals):
         self._dj_handle_special_fields_write(vals)
         return super(Base, self).create(vals)
+
+    @api.model
+    def _dj_apply_tombstones(self, path):
+        """Delete records listed by a delta burn tombstones track.
+
+        :param path: CSV path relative to `ODOO_DATA_PATH`
+        :return: deleted records' xmlids
+        """
+        with open(os.path.join(ODOO_DATA_PATH, path)) as fd:
+            # skip header
+            xmlids = [row[0] for row in list(csv.reader(fd))[1:] if row]
+        records = self.browse()
+        for xmlid in xmlids:
+            record = self.env.ref(xmlid, raise_if_not_found=False)
+            if record and record._name == self._name:
+                records |= record
+        _logger.info('Deleting %d %s records', len(records), self._name)
+        records.unlink()
+        return xmlids
@@ -4,3 +4,6 @@ from . import dj_genre
 from . import dj_equalizer
 from . import dj_compilation
 from . import dj_song
+from . import dj_track_cache
+from . import dj_burn_job
+from . import dj_id_set
@@ -0,0 +1,215 @@
+# Copyright 2017 Camptocamp SA
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl)
+
+from odoo import models, fields, api, exceptions, tools, _
+import json
+import logging
+import tempfile
+
+from ...config import (
+    SPOOL_MAX_SIZE,
+    BURN_JOB_LOCK_KEY,
+    BURN_JOB_STALE_TIMEOUT,
+)
+from ...progress import BurnProgress, BurnCancelled
+
+_logger = logging.getLogger(__name__)
+
+
+class BurnJob(models.Model):
+    """Burn compilations in background.
+
+    Pending jobs are run by a cron, one at a time,
+    and the zip is stored as an attachment of the job.
+    """
+
+    _name = 'dj.burn.job'
+    _order = 'id desc'
+
+    name = fields.Char(required=True, readonly=True)
+    compilation_ids = fields.Many2many(
+        string='Compilations',
+        comodel_name='dj.compilation',
+        required=True,
+        readonly=True,
+    )
+    options = fields.Text(
+        readonly=True,
+        help='Burn options as JSON. See `dj_burn_options_flags`.',
+    )
+    state = fields.Selection(
+        selection=[
+            ('pending', 'Pending'),
+            ('running', 'Running'),
+            ('done', 'Done'),
+            ('failed', 'Failed'),
+            ('cancelled', 'Cancelled'),
+        ],
+        default='pending',
+        required=True,
+        readonly=True,
+        index=True,
+    )
+    cancel_requested = fields.Boolean(readonly=True)
+    song_count = fields.Integer(readonly=True)
+    song_done = fields.Integer(readonly=True)
+    current_song = fields.Char(readonly=True)
+    progress = fields.Float(compute='_compute_progress')
+    date_start = fields.Datetime(readonly=True)
+    date_end = fields.Datetime(readonly=True)
+    error = fields.Text(readonly=True)
+    attachment_id = fields.Many2one(
+        string='Burnt zip',
+        comodel_name='ir.attachment',
+        readonly=True,
+        ondelete='set null',
+    )
+
+    @api.depends('state', 'song_count', 'song_done')
+    def _compute_progress(self):
+        for item in self:
+            if item.song_count:
+                item.progress = 100.0 * item.song_done / item.song_count
+            else:
+                item.progress = 100.0 if item.state == 'done' else 0.0
+
+    @api.model
+    def create_for(self, compilations, options=None):
+        """Create a job burning `compilations` w/ given burn options."""
+        return self.create({
+            'name': ', '.join(compilations.mapped('name')),
+            'compilation_ids': [(6, 0, compilations.ids)],
+            'options': json.dumps(options or {}, default=str),
+        })
+
+    @api.multi
+    def action_cancel(self):
+        for job in self:
+            if job.state == 'pending':
+                job.state = 'cancelled'
+            elif job.state == 'running':
+                # the job stops before burning next song
+                job.cancel_requested = True
+        return True
+
+    @api.multi
+    def action_download(self):
+        self.ensure_one()
+        if not self.attachment_id:
+            raise exceptions.UserError(_('Nothing to download yet.'))
+        return {
+            'type': 'ir.actions.act_url',
+            'target': 'new',
+            'url': '/dj/download/attachment/{}'.format(
+                self.attachment_id.id),
+        }
+
+    @api.model
+    def _cron_run(self):
+        """Run pending jobs, oldest first."""
+        self._recover_stale()
+        while True:
+            self.env.cr.execute("""
+                SELECT id FROM dj_burn_job
+                WHERE state = 'pending'
+                ORDER BY id
+                LIMIT 1
+                FOR UPDATE SKIP LOCKED
+            """)
+            row = self.env.cr.fetchone()
+            if not row:
+                break
+            job = self.browse(row[0])
+            job.sudo(job.create_uid)._run()
+
+    @api.model
+    def _recover_stale(self):
+        """Fail running jobs whose process died.
+
+        A running job holds its advisory lock (see `_run`)
+        which is released w/ the connection of a dead process.
+        """
+        self.env.cr.execute("""
+            SELECT id FROM dj_burn_job
+            WHERE state = 'running'
+            AND date_start < (now() at time zone 'UTC') - %s * interval '1s'
+            ORDER BY id
+            FOR UPDATE SKIP LOCKED
+        """, (BURN_JOB_STALE_TIMEOUT, ))
+        job_ids = [x[0] for x in self.env.cr.fetchall()]
+        stale = []
+        for job_id in job_ids:
+            self.env.cr.execute(
+                'SELECT pg_try_advisory_xact_lock(%s, %s)',
+                (BURN_JOB_LOCK_KEY, job_id))
+            if self.env.cr.fetchone()[0]:
+                stale.append(job_id)
+        if not stale:
+            return
+        _logger.warning('Burn jobs %s interrupted: marked as failed', stale)
+        self.browse(stale).write({
+            'state': 'failed',
+            'error': _('Burn interrupted (eg: server restart).'),
+            'date_end': fields.Datetime.now(),
+        })
+        self.env.cr.commit()
+
+    def _run(self):
+        """Burn the compilations holding the job's advisory lock."""
+        self.ensure_one()
+        cr = self.env.cr
+        cr.execute('SELECT pg_advisory_lock(%s, %s)',
+                   (BURN_JOB_LOCK_KEY, self.id))
+        try:
+            self._burn()
+        finally:
+            cr.execute('SELECT pg_advisory_unlock(%s, %s)',
+                       (BURN_JOB_LOCK_KEY, self.id))
+
+    def _burn(self):
+        """Burn the compilations.
+
+        Changes are committed at each stage: progress is written
+        by another transaction while burning.
+        """
+        self.write({
+            'state': 'running',
+            'date_start': fields.Datetime.now(),
+        })
+        self.env.cr.commit()
+        ctx = self.env['dj.compilation'].make_burn_ctx_via_params(
+            **json.loads(self.options or '{}'))
+        ctx['dj_burn_progress'] = BurnProgress(self.env, self.id)
+        compilations = self.compilation_ids.with_context(**ctx)
+        try:
+            if int(ctx.get('dj_burn_workers') or 0) > 1:
+                # workers see only committed data
+                compilations.burn_prepare()
+                self.env.cr.commit()
+                compilations = compilations.with_context(
+                    dj_burn_parallel=True)
+            with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) as fp:
+                filename = compilations.burn_to_file(fp)
+                # keep burn changes (eg: new xmlids)
+                self.env.cr.commit()
+                attachment = self._store_result(filename, fp)
+            vals = {'state': 'done', 'attachment_id': attachment.id}
+        except BurnCancelled:
+            self.env.cr.rollback()
+            vals = {'state': 'cancelled'}
+        except Exception as err:
+            self.env.cr.rollback()
+            _logger.exception('Burn job %d failed', self.id)
+            vals = {'state': 'failed', 'error': tools.ustr(err)}
+        self.invalidate_cache()
+        vals['date_end'] = fields.Datetime.now()
+        self.write(vals)
+        self.env.cr.commit()
+
+    def _store_result(self, filename, fp):
+        return self.env['ir.attachment'].sudo().dj_create_from_file(fp, {
+            'name': filename,
+            'datas_fname': filename,
+            'res_model': self._name,
+            'res_id': self.id,
+        })
@@ -4,15 +4,29 @@
 try:
     import autopep8
 except ImportError:
-    import logging
-    _logger = logging.getLogger(__name__)
-    _logger.warning('`autopep8` dependency lib is missing.')
+    # optional: see `dj_autopep8` burn option
+    autopep8 = None
+import hashlib
+import io
+import logging
 import os
+from collections import OrderedDict
+from functools import partial
 from urllib.parse import urlencode
 
 from odoo import models, fields, api, exceptions, _
-from ...utils import create_zipfile, make_title, to_str
+from odoo.tools.lru import LRU
+from ...utils import create_zipfile, make_title, to_str, write_tree
 from ...slugifier import slugify
+from ...xmlid import XMLIDResolver
+from ...layout import CompilationLayout
+from ...parallel import burn_songs
+from ...config import BURN_WORKERS_MAX, BURN_MANIFEST_PATH
+
+_logger = logging.getLogger(__name__)
+
+# autopep8 results by disc content hash
+_autopep8_cache = LRU(32)
 
 
 class Compilation(models.Model):
@@ -168,7 +182,15 @@ class Compilation(models.Model):
             'dj_exclude_core',
             'dj_xmlid_force',
             'dj_xmlid_skip_create',
+            'dj_xmlid_conflict',
             'dj_force_data_mode',
+            'dj_burn_workers',
+            'dj_incremental',
+            'dj_delta',
+            'dj_delta_since',
+            'dj_delta_baseline',
+            'dj_track_cache',
+            'dj_autopep8',
         )
 
     def make_burn_ctx_via_params(self, **kw):
@@ -262,15 +284,53 @@ class Compilation(models.Model):
         return song.new(song_data)
 
     @api.multi
-    def _get_tracks(self):
-        """Collect files to burn from all compilations."""
+    def _get_tracks(self, lazy=False):
+        """Collect files to burn from all compilations.
+
+        :param lazy: songs' content is computed only when written.
+            See `Song.burn_track`.
+        """
         files = []
         songs = self._get_all_songs()
+        workers = min(int(self.env.context.get('dj_burn_workers') or 0),
+                      BURN_WORKERS_MAX)
+        # only burn jobs fork workers: they own their transaction
+        # and commit missing xmlids beforehand, see `burn_prepare`
+        parallel = (self.env.context.get('dj_burn_parallel') and
+                    workers > 1 and len(songs) > 1)
+        if parallel:
+            self._check_burn_parallel()
+        resolver = self.env.context.get('dj_xid_resolver')
+        if resolver is not None:
+            resolver.preload(self._get_xmlid_models(songs))
+            if not parallel:
+                self._prepare_xmlids(songs)
         for comp in self:
             files.append(comp.burn_disc())
-        for song in songs:
-            track = song.burn_track()
-            if track:
+        # burn jobs' progress, see `BurnProgress`
+        progress = self.env.context.get('dj_burn_progress')
+        if parallel:
+            if progress is not None:
+                progress.start(len(songs))
+            for song, track in zip(songs, burn_songs(self, songs, workers)):
+                if progress is not None:
+                    track = progress.track(song, track)
+                files.extend(track)
+        else:
+            incremental = self.env.context.get('dj_incremental')
+            # translations are burnt w/ their original song
+            songs = songs.filtered(lambda x: not x.export_lang)
+            if progress is not None:
+                progress.start(len(songs))
+            for song in songs:
+                if incremental:
+                    track = song.burn_track_incremental(lazy=lazy)
+                else:
+                    track = song.burn_track(lazy=lazy) or []
+                    if song.export_translations:
+                        track.extend(song.burn_translation_tracks(lazy=lazy))
+                if progress is not None:
+                    track = progress.track(song, track)
                 files.extend(track)
 
         # add __init__.py to song folders
@@ -294,17 +354,98 @@ class Compilation(models.Model):
             files.append(config_comp.with_context(**forced_args).burn())
         return files
 
+    def _get_xmlid_models(self, songs):
+        """Collect all the models whose xmlids are going to be exported."""
+        models = set()
+        for song in songs:
+            models.update(song._get_xmlid_models())
+        return models
+
+    def _prepare_xmlids(self, songs):
+        """Create all the missing xmlids before exporting anything.
+
+        Exported records and related records exported as `/id`
+        are collected for all the songs and grouped by model
+        and xmlid generation settings.
+        Missing xmlids are then created w/ one bulk operation per group
+        hence the export phase only reads `ir_model_data`.
+        """
+        groups = OrderedDict()
+        for song in songs:
+            ctx = song._dj_export_context()
+            modname = song.compilation_id.xmlid_module_name
+            for model, ids in song._get_xmlid_records().items():
+                xmlid_fields = ctx['dj_xmlid_fields_map'].get(model) or []
+                key = (
+                    model, modname,
+                    tuple(xmlid_fields), ctx['dj_multicompany'],
+                )
+                groups.setdefault(key, set()).update(ids)
+        for key, ids in groups.items():
+            model, modname, xmlid_fields, multicompany = key
+            records = self.env[model].with_context(
+                dj_xmlid_module=modname,
+                dj_xmlid_fields_map={model: list(xmlid_fields)},
+                dj_multicompany=multicompany,
+            ).browse(sorted(ids))
+            if not records or not records._is_an_ordinary_table():
+                continue
+            # by batches: do not load whole tables into the cache
+            for batch in self.env['dj.song']._export_batches(records):
+                batch._dj_export_xmlids()
+
+    def _burn_include_core(self):
+        # at least one of the compilations requires to exclude core ones
+        return not (
+            any(self.mapped('exclude_core')) or
+            self.env.context.get('dj_exclude_core')
+        )
+
+    def _check_burn_parallel(self):
+        """Parallel workers write nothing: refuse burns storing data."""
+        ctx = self.env.context
+        if ctx.get('dj_incremental') or ctx.get('dj_delta_baseline'):
+            raise exceptions.UserError(_(
+                'Incremental burns and delta baselines '
+                'are not available w/ parallel workers.'))
+
     @api.multi
-    def get_all_tracks(self, include_core=True):
+    def burn_prepare(self):
+        """Create the missing xmlids of all the songs to burn.
+
+        Parallel workers see only committed data: burn jobs
+        run this and commit before burning w/ `dj_burn_parallel`.
+        Workers refuse to create xmlids missing anyway
+        (eg: settings' values).
+        """
+        self._check_burn_parallel()
+        compilations = self
+        if self._burn_include_core():
+            compilations |= self._get_core_compilations()
+        compilations._prepare_xmlids(compilations._get_all_songs())
+
+    @api.multi
+    def get_all_tracks(self, include_core=True, lazy=False):
         """Return all files to burn into the compilation."""
         compilations = self
         if include_core:
             compilations |= self._get_core_compilations()
-        return compilations._get_tracks()
+        return compilations._get_tracks(lazy=lazy)
+
+    def dj_layout(self):
+        """Return songs' layout, computed once per burn.
+
+        See `CompilationLayout`.
+        """
+        layouts = self.env.context.get('dj_layouts')
+        if layouts is None or not self:
+            return CompilationLayout(self)
+        if self.id not in layouts:
+            layouts[self.id] = CompilationLayout(self)
+        return layouts[self.id]
 
     def disc_full_path(self):
-        path = self.disc_path.format(**self.read()[0])
-        return to_str(path)
+        return self.dj_layout().disc_full_path
 
     @api.multi
     def toggle_active(self):
@@ -317,10 +458,34 @@ class Compilation(models.Model):
     def burn_disc(self):
         """Burn the disc with songs."""
         self.ensure_one()
+        path = self.disc_full_path()
+        # templates render PEP8 compliant code already
         content = self.dj_render_template()
-        # make sure PEP8 is safe
-        content = autopep8.fix_code(content)
-        return self.disc_full_path(), to_str(content)
+        if self.env.context.get('dj_autopep8'):
+            content = self._dj_autopep8(path, content)
+        return path, content
+
+    def _dj_autopep8(self, path, content):
+        """Fix `content` w/ autopep8, memoized by content hash."""
+        if autopep8 is None:
+            _logger.warning('`autopep8` lib is missing: disc is not fixed.')
+            return content
+        key = hashlib.md5('disc:{}'.format(content).encode()).hexdigest()
+        fixed = _autopep8_cache.get(key)
+        if fixed is not None:
+            return fixed
+        cache = None
+        if self.env.context.get('dj_track_cache'):
+            cache = self.env['dj.track.cache']
+            cached = cache.get_tracks(key)
+            if cached:
+                fixed = cached[0][1].decode('utf-8')
+        if fixed is None:
+            fixed = to_str(autopep8.fix_code(content))
+            if cache is not None:
+                cache.store(key, [(path, fixed)])
+        _autopep8_cache[key] = fixed
+        return fixed
 
     @api.multi
     def burn_dev_readme(self):
@@ -331,19 +496,83 @@ class Compilation(models.Model):
     @api.multi
     def burn(self):
         """Burn disc into a zip file."""
-        # at least one of the compilations requires to exclude core ones
-        exclude_core = (
-            any(self.mapped('exclude_core')) or
-            self.env.context.get('dj_exclude_core')
-        )
+        fp = io.BytesIO()
+        filename = self.burn_to_file(fp)
+        return filename, fp.getvalue()
+
+    @api.multi
+    def burn_to_file(self, fileobj):
+        """Burn disc as a zip file into `fileobj` and return its name.
+
+        Tracks are written as soon as they are burnt:
+        use a temporary file to keep memory usage bounded.
+        """
+        # CSV tracks are streamed into the zip while writing it
+        self._burn_tracks(partial(create_zipfile, fileobj=fileobj))
+        return self.make_album_title()
+
+    @api.multi
+    def burn_to_directory(self, path, prune=False):
+        """Burn disc straight into `path` directory.
+
+        Only files whose content changed are written.
+        Files burnt are listed in a manifest per set of compilations:
+        only the ones listed by their previous burn can be pruned.
+        See `utils.write_tree` for `prune` and the returned report.
+        """
+        manifest = BURN_MANIFEST_PATH.format(
+            name='_'.join(sorted(self.mapped('name'))))
+        report = self._burn_tracks(
+            partial(write_tree, path, manifest=manifest, prune=prune))
+        _logger.info(
+            'Burnt into %s: %d added, %d changed, %d %s',
+            path, len(report['added']), len(report['changed']),
+            len(report['removed']), 'removed' if prune else 'stale')
+        return report
+
+    def _burn_tracks(self, write):
+        """Collect tracks to burn and return the result of `write(tracks)`.
+
+        `write` must write lazy tracks too: they are burnt meanwhile.
+        """
+        resolver = XMLIDResolver(self.env.cr)
+        # songs reused or burnt by incremental burns
+        summary = {'reused': [], 'burnt': []}
         files = self.with_context(
             # pass around the IDS the we are asked to burn.
             # Used in export self config for instance.
-            dj_burning_ids=self.ids
-        ).get_all_tracks(include_core=not exclude_core)
-        zf = create_zipfile(files)
-        filename = self.make_album_title()
-        return filename, zf.read()
+            dj_burning_ids=self.ids,
+            # resolve xmlids from memory for the whole burn
+            dj_xid_resolver=resolver,
+            dj_burn_summary=summary,
+            # store big lists of IDs to search them, see `dj.id.set`
+            dj_id_sets=True,
+            # songs' positions, names and paths by compilation ID
+            dj_layouts={},
+            # delta baselines by song ID, parsed once
+            dj_delta_manifests={},
+        ).get_all_tracks(include_core=self._burn_include_core(), lazy=True)
+        if self.env.context.get('dj_incremental'):
+            files.append(self.burn_summary(summary))
+        res = write(files)
+        resolver.log_stats()
+        return res
+
+    @api.multi
+    def burn_summary(self, summary):
+        """Burn a summary of songs reused or burnt by incremental burns."""
+        lines = ['Burn summary', '============', '']
+        for key, title in (('reused', 'Reused songs'),
+                           ('burnt', 'Burnt songs')):
+            lines.extend([title, '-' * len(title), ''])
+            for song in summary[key]:
+                lines.append('* {}: {}'.format(
+                    song.compilation_id.name, song.name))
+            lines.append('')
+        _logger.info(
+            'Incremental burn: %d songs reused, %d burnt',
+            len(summary['reused']), len(summary['burnt']))
+        return 'BURN_SUMMARY.rst', '\n'.join(lines)
 
     def make_album_title(self):
         name = ['mutiple_compilations', ]
@@ -352,8 +581,7 @@ class Compilation(models.Model):
         return make_title('_'.join(name))
 
     def anthem_path(self):
-        path = self.disc_full_path().replace('/', '.').replace('.py', '')
-        return '{}::main'.format(path)
+        return self.dj_layout().anthem_path()
 
     def _export_config_get_song_data(self, song):
         """Return export values for given song."""
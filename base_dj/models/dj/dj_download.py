@@ -3,6 +3,7 @@
 
 from odoo import models, fields, api
 from urllib.parse import urlencode
+from ...config import BURN_STATE_CTX_KEYS
 
 
 class DownloadMixin(models.AbstractModel):
@@ -17,7 +18,10 @@ class DownloadMixin(models.AbstractModel):
     @api.depends()
     def _compute_download_url(self):
         # propagate our ctx keys
-        ctx = {k: v for k, v in self.env.context.items() if k.startswith('dj')}
+        ctx = {
+            k: v for k, v in self.env.context.items()
+            if k.startswith('dj') and k not in BURN_STATE_CTX_KEYS
+        }
         for item in self:
             url = self._dj_download_path + str(item.id)
             if ctx:
@@ -1,10 +1,17 @@
 # Copyright 2017 Camptocamp SA
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl)
 
-from odoo import models, fields, api
+from odoo import models, fields, api, tools
 from odoo.tools.safe_eval import safe_eval
 from collections import OrderedDict
+import copy
+import logging
+
 from ...utils import string_to_list
+from ...config import XMLID_HASH_LENGTH
+from ...xmlid import ShortHashIndex
+
+_logger = logging.getLogger(__name__)
 
 
 class OrderedContext(OrderedDict):
@@ -24,10 +31,20 @@ class DJEqualizer(models.Model):
     model = fields.Char(default='')
     xmlid_fields = fields.Char(default='')
     xmlid_policy = fields.Selection(
-        selection=[('normal', 'Normal'), ('hash', 'Hash')],
+        selection=[
+            ('normal', 'Normal'),
+            ('hash', 'Hash'),
+            ('short_hash', 'Short hash'),
+        ],
         default='normal',
         help='`Normal` will join all fields, '
-             '`hash` will use specified fields to build an hash.'
+             '`hash` will use specified fields to build an hash, '
+             '`short hash` will do the same w/ a shorter hash.'
+    )
+    xmlid_hash_length = fields.Integer(
+        default=XMLID_HASH_LENGTH,
+        help='Length of the hash for `short hash` policy. '
+             'It grows automatically only when 2 hashes collide.'
     )
     xmlid_table_name = fields.Char(
         default='',
@@ -66,17 +83,133 @@ class DJEqualizer(models.Model):
         if not self.ids:
             return []
         self.ensure_one()
-        return string_to_list(
-            self.record_blacklist,
-            modifier=lambda x: self.env.ref(x).id)
+        ids = []
+        for xid in string_to_list(self.record_blacklist):
+            try:
+                record = self.env.ref(xid, raise_if_not_found=False)
+            except ValueError:
+                # not a fully qualified xmlid
+                record = None
+            if not record:
+                # a stale xmlid must not break the whole configuration
+                _logger.warning(
+                    'Equalizer %s: blacklisted record %s not found',
+                    self.model, xid)
+                continue
+            ids.append(record.id)
+        return ids
 
     def get_conf(self, key=None):
         all_keys = {
             'xmlid_fields': self.get_xmlid_fields(),
             'xmlid_policy': self.xmlid_policy,
+            'xmlid_hash_length': self.xmlid_hash_length,
             'xmlid_table_name': self.xmlid_table_name,
             'model_context': self.get_model_context(),
             'field_blacklist': self.get_field_blacklist(),
             'record_blacklist': self.get_record_blacklist(),
         }
         return all_keys.get(key, all_keys)
+
+    @api.model
+    def get_model_conf(self, model, key=None):
+        """Return the configuration for `model`, same as `get_conf`.
+
+        Values are copies: change them freely.
+        """
+        registry = self._get_registry()
+        conf = registry.get(model) or registry[None]
+        return copy.deepcopy(conf.get(key, conf))
+
+    @api.model
+    @tools.ormcache()
+    def _get_registry(self):
+        """Load and parse all the equalizers at once.
+
+        Cached until equalizers change.
+
+        :return: `{model: conf}` where `None` holds the default conf
+        """
+        registry = {None: self.browse().get_conf()}
+        # first equalizer wins, as `search([('model', '=', ...)], limit=1)`
+        for item in self.sudo().search([], order='id desc'):
+            registry[item.model] = item.get_conf()
+        return registry
+
+    @api.model
+    def create(self, vals):
+        res = super().create(vals)
+        self.clear_caches()
+        return res
+
+    @api.multi
+    def write(self, vals):
+        res = super().write(vals)
+        self.clear_caches()
+        return res
+
+    @api.multi
+    def unlink(self):
+        res = super().unlink()
+        self.clear_caches()
+        return res
+
+    @api.multi
+    def action_migrate_hash_xmlids(self):
+        self.migrate_hash_xmlids()
+        return True
+
+    @api.multi
+    def migrate_hash_xmlids(self, module='__setup__'):
+        """Rewrite `hash` policy xmlids to `short_hash` ones.
+
+        Short hashes are computed from the long ones,
+        hence we get the same names a new burn would generate.
+        Names already taken are left untouched.
+
+        :return: number of xmlids renamed
+        """
+        index = ShortHashIndex()
+        imd = self.env['ir.model.data']
+        count = 0
+        for item in self.filtered(lambda x: x.xmlid_policy == 'short_hash'):
+            self.env.cr.execute("""
+                SELECT id, name
+                FROM ir_model_data
+                WHERE module = %s AND model = %s AND name ~ '_[0-9a-f]{32}$'
+                ORDER BY res_id
+            """, (module, item.model))
+            renames = {}
+            for imd_id, name in self.env.cr.fetchall():
+                prefix, digest = name[:-32], name[-32:]
+                renames[imd_id] = prefix + index.shorten(
+                    item.model, prefix, digest, item.xmlid_hash_length)
+            if not renames:
+                continue
+            self.env.cr.execute("""
+                SELECT name FROM ir_model_data
+                WHERE module = %s AND name IN %s
+            """, (module, tuple(renames.values())))
+            taken = set(x[0] for x in self.env.cr.fetchall())
+            rows = []
+            for imd_id, name in sorted(renames.items()):
+                if name in taken:
+                    _logger.warning(
+                        'XMLID %s.%s already exists: skip ir.model.data %d',
+                        module, name, imd_id)
+                    continue
+                rows.append((imd_id, name))
+            if not rows:
+                continue
+            self.env.cr.execute("""
+                UPDATE ir_model_data d SET name = v.name
+                FROM (VALUES {}) AS v(id, name)
+                WHERE d.id = v.id
+            """.format(', '.join(['%s'] * len(rows))), rows)
+            count += len(rows)
+            _logger.info('Renamed %d hash xmlids for %s',
+                         len(rows), item.model)
+        if count:
+            # xmlids lookup is cached
+            imd.clear_caches()
+        return count
@@ -0,0 +1,167 @@
+# Copyright 2017 Camptocamp SA
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl)
+
+from odoo import models, fields, api, exceptions, _
+import hashlib
+import logging
+import re
+
+from ...config import ID_SET_THRESHOLD, ID_SET_MAX_AGE, ID_SET_REF
+
+_logger = logging.getLogger(__name__)
+
+
+class IDSet(models.Model):
+    """Store big sets of record IDs to search w/ them via SQL.
+
+    Songs' domains refer to big sets by key (see `reference`)
+    and `expand_domain` turns them, as well as big literal lists of IDs,
+    into sub-selects on the indexed `dj_id_set_item` table when searching.
+    Temporary sets are stored only while burning (`dj_id_sets` ctx key):
+    other searches use a sub-select on an array and write nothing.
+    """
+
+    _name = 'dj.id.set'
+    _rec_name = 'key'
+
+    key = fields.Char(required=True, index=True, readonly=True)
+    model = fields.Char(required=True, readonly=True)
+    count = fields.Integer(readonly=True)
+    last_used = fields.Datetime(readonly=True, index=True)
+
+    _sql_constraints = [
+        ('key_uniq', 'unique(key)', 'ID set key must be unique.'),
+    ]
+
+    @api.model_cr
+    def init(self):
+        self.env.cr.execute("""
+            CREATE TABLE IF NOT EXISTS dj_id_set_item (
+                set_id integer NOT NULL
+                    REFERENCES dj_id_set(id) ON DELETE CASCADE,
+                res_id integer NOT NULL,
+                PRIMARY KEY (set_id, res_id)
+            )
+        """)
+
+    @staticmethod
+    def _make_key(model, ids):
+        return hashlib.md5('{}:{}'.format(
+            model, ','.join(map(str, ids))).encode()).hexdigest()
+
+    @api.model
+    def store(self, model, ids, chunk_size=10000):
+        """Store `ids` of `model` and return the ID of the set.
+
+        Sets are keyed by their content: the same IDs share one set.
+        Concurrent burns storing the same set do not conflict.
+        """
+        ids = sorted(set(ids))
+        key = self._make_key(model, ids)
+        now = fields.Datetime.now()
+        cr = self.env.cr
+        cr.execute("""
+            INSERT INTO dj_id_set
+                (key, model, count, last_used,
+                 create_uid, create_date, write_uid, write_date)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+            ON CONFLICT (key) DO NOTHING
+            RETURNING id
+        """, (key, model, len(ids), now,
+              self.env.uid, now, self.env.uid, now))
+        row = cr.fetchone()
+        if row is None:
+            # stored already
+            cr.execute("""
+                UPDATE dj_id_set SET last_used = %s
+                WHERE key = %s
+                RETURNING id
+            """, (now, key))
+            return cr.fetchone()[0]
+        set_id = row[0]
+        for i in range(0, len(ids), chunk_size):
+            cr.execute("""
+                INSERT INTO dj_id_set_item (set_id, res_id)
+                SELECT %s, unnest(%s)
+                ON CONFLICT DO NOTHING
+            """, (set_id, ids[i:i + chunk_size]))
+        return set_id
+
+    @api.model
+    def reference(self, model, ids):
+        """Return the value to store into domains to search `ids`.
+
+        Small lists are kept as they are,
+        big ones are stored and referred by key.
+        """
+        ids = sorted(set(ids))
+        if len(ids) <= ID_SET_THRESHOLD:
+            return ids
+        self.store(model, ids)
+        return ID_SET_REF + self._make_key(model, ids)
+
+    @api.model
+    def leaf(self, model, ids, operator='in'):
+        """Return the domain leaf searching IDs `in` or `not in` `ids`.
+
+        Small lists are kept as they are.
+        """
+        ids = list(ids)
+        if len(ids) <= ID_SET_THRESHOLD:
+            return ('id', operator, ids)
+        sub_operator = 'inselect' if operator == 'in' else 'not inselect'
+        if not self.env.context.get('dj_id_sets'):
+            return ('id', sub_operator, (
+                'SELECT unnest(%s::integer[])', (ids, )))
+        set_id = self.store(model, ids)
+        return ('id', sub_operator, (
+            'SELECT res_id FROM dj_id_set_item WHERE set_id = %s',
+            (set_id, )))
+
+    @api.model
+    def _reference_leaf(self, ref, operator='in'):
+        """Return the domain leaf searching IDs of a referred set."""
+        key = ref[len(ID_SET_REF):]
+        self.env.cr.execute(
+            'SELECT id FROM dj_id_set WHERE key = %s', (key, ))
+        row = self.env.cr.fetchone()
+        if row is None:
+            raise exceptions.UserError(
+                _('ID set %s not found. Update song dependencies.') % key)
+        sub_operator = 'inselect' if operator == 'in' else 'not inselect'
+        return ('id', sub_operator, (
+            'SELECT res_id FROM dj_id_set_item WHERE set_id = %s',
+            (row[0], )))
+
+    @api.model
+    def expand_domain(self, model, domain):
+        """Replace references and big lists of IDs into `domain`."""
+        res = []
+        for leaf in domain:
+            if (isinstance(leaf, (list, tuple)) and len(leaf) == 3 and
+                    leaf[0] == 'id' and leaf[1] in ('in', 'not in')):
+                if (isinstance(leaf[2], str) and
+                        leaf[2].startswith(ID_SET_REF)):
+                    leaf = self._reference_leaf(leaf[2], leaf[1])
+                elif isinstance(leaf[2], (list, tuple, set)):
+                    leaf = self.leaf(model, leaf[2], leaf[1])
+            res.append(leaf)
+        return res
+
+    @api.model
+    def _gc(self):
+        """Drop sets not used lately and not referred by songs."""
+        cr = self.env.cr
+        cr.execute("""
+            SELECT domain FROM dj_song WHERE domain LIKE %s
+        """, ('%' + ID_SET_REF + '%', ))
+        pattern = re.compile(re.escape(ID_SET_REF) + r'([0-9a-f]{32})')
+        keys = set()
+        for domain, in cr.fetchall():
+            keys.update(pattern.findall(domain))
+        cr.execute("""
+            DELETE FROM dj_id_set
+            WHERE last_used < (now() at time zone 'UTC') - %s * interval '1s'
+            AND NOT key = ANY(%s)
+        """, (ID_SET_MAX_AGE, list(keys)))
+        _logger.info('ID sets: %d unused sets deleted', cr.rowcount)
@@ -5,7 +5,9 @@ from odoo import models, fields, api, exceptions, tools, _
 from odoo.tools.safe_eval import safe_eval, test_python_expr
 from odoo.modules import get_module_path
 from ...utils import (
-    csv_from_data,
+    write_csv,
+    copy_and_close,
+    materialize_tracks,
     force_company,
     context_to_string,
     to_str,
@@ -15,9 +17,19 @@ from ...config import (
     SPECIAL_FIELDS,
     SONG_TYPES,
     DEFAULT_PYTHON_CODE,
+    XMLID_CHUNK_SIZE,
+    EXPORT_BATCH_SIZE,
+    SPOOL_MAX_SIZE,
+    DELTA_MANIFEST_NAME,
 )
-from collections import defaultdict, Counter
+from collections import defaultdict
+from functools import partial
+import base64
+import hashlib
+import io
+import json
 import os
+import tempfile
 
 testing = tools.config.get('test_enable') or os.environ.get('ODOO_TEST_ENABLE')
 
@@ -124,6 +136,12 @@ class Song(models.Model):
     )
     export_translations = fields.Boolean(default=False)
     export_lang = fields.Char()
+    burn_fingerprint = fields.Char(
+        readonly=True,
+        copy=False,
+        help='Fingerprint of the last incremental burn. '
+             'Tracks are reused as long as it does not change.',
+    )
     exec_hook = fields.Selection(
         selection=[('pre', 'pre'), ('post', 'post')],
         default='post',
@@ -132,11 +150,29 @@ class Song(models.Model):
 
     @api.depends('model_id', 'sequence', 'compilation_id.song_ids')
     def _compute_position_in_collection(self):
+        layouts = self._get_layouts()
         for item in self:
-            item.position_in_collection = [
-                i + 1 for i, x in enumerate(item.compilation_id.song_ids)
-                if x.id == item.id
-            ][0]
+            layout = layouts[item.compilation_id.id]
+            item.position_in_collection = layout.position(item)
+
+    def _scan_position(self):
+        # songs unknown to the layout (eg: shadow songs)
+        for i, song in enumerate(self.compilation_id.song_ids, 1):
+            if song.id == self.id:
+                return i
+        return 0
+
+    def _get_layouts(self):
+        """Return layouts of songs' compilations by compilation ID."""
+        layouts = {}
+        for song in self:
+            comp = song.compilation_id
+            if comp.id not in layouts:
+                layouts[comp.id] = comp.dj_layout()
+        return layouts
+
+    def _dj_layout(self):
+        return self.compilation_id.dj_layout()
 
     @api.constrains('python_code')
     def _check_python_code(self):
@@ -179,7 +215,9 @@ class Song(models.Model):
         # So, here we just ignore existing domain
         # assuming that if you want to play w/ the domain
         # you gonna do it *after* playing w/ song dependencies.
-        self.domain = str([('id', 'in', list(ids))])
+        # Big lists are stored apart, see `dj.id.set`.
+        ids = self.env['dj.id.set'].reference(self.model_name, ids)
+        self.domain = str([('id', 'in', ids)])
 
     @api.onchange('records_count')
     def onchange_records_count(self):
@@ -198,6 +236,10 @@ class Song(models.Model):
         res = {
             'song': self,
             'header_exclude': self.get_csv_field_names_exclude(),
+            'xmlid_chunk_size': XMLID_CHUNK_SIZE,
+            'tombstones_path': (
+                self.real_tombstones_path() if self._has_tombstones()
+                else None),
         }
         return res
 
@@ -205,33 +247,20 @@ class Song(models.Model):
     def _song_model_count_key(self):
         return (self.model_name, self.song_type)
 
-    @property
-    def _songs_models_count(self):
-        # count songs in the same compilation w/ the same model and same type
-        return Counter(
-            self.compilation_id.song_ids.mapped(
-                lambda x: x._song_model_count_key)
+    def _base_name(self):
+        song_type = self.available_song_types.get(self.song_type, {})
+        return '{}{}{}'.format(
+            song_type.get('prefix', 'load_'),
+            (self.model_id.model or '').replace('.', '_'),
+            song_type.get('suffix', ''),
         )
 
     @api.multi
     @api.depends('model_id.model', 'song_type')
     def _compute_song_name(self):
+        layouts = self._get_layouts()
         for item in self:
-            prefix = self.available_song_types.get(
-                item.song_type, {}).get('prefix', 'load_')
-            suffix = self.available_song_types.get(
-                item.song_type, {}).get('suffix', '')
-            name = '{}{}{}'.format(
-                prefix,
-                (item.model_id.model or '').replace('.', '_'),
-                suffix,
-            )
-            if item._songs_models_count[item._song_model_count_key] > 1:
-                # make name unique in the compilation
-                name += '_%d' % item.position_in_collection
-            if item.export_lang:
-                name += '_' + item.export_lang
-            item.name = name
+            item.name = layouts[item.compilation_id.id].song_name(item)
 
     @api.multi
     @api.depends('model_id.model', 'domain', 'python_code')
@@ -270,7 +299,8 @@ class Song(models.Model):
         ids_blacklist = self._dj_global_config('record_blacklist') or []
         if ids_blacklist:
             domain.append(('id', 'not in', ids_blacklist))
-        return domain
+        # big lists of IDs are searched via SQL sub-selects
+        return self.env['dj.id.set'].expand_domain(self.model_name, domain)
 
     @api.model
     def eval_python_code(self):
@@ -319,50 +349,459 @@ class Song(models.Model):
             return context_to_string(ctx)
         return ctx
 
-    def _real_path_data(self):
-        return {
-            'model': self.song_model._name,
-            'data_mode': self.compilation_id.data_mode,
-            'genre': self.compilation_id.genre_id.name,
-            'comp_name': self.compilation_id.name,
-        }
-
-    def _real_path(self, pattern):
-        path = pattern.format(**self._real_path_data())
-        if self._songs_models_count[self._song_model_count_key] > 1:
-            # make filename unique. Include position to match song name
-            path, ext = os.path.splitext(path)
-            path += '_%d' % self.position_in_collection
-            path += ext
-        return path
-
     def real_csv_path(self):
         """Final csv path into zip file."""
-        return self._real_path(self.csv_path)
+        return self._dj_layout().csv_path(self)
 
     def real_binaries_path(self):
         """Final path for binary files."""
-        return self._real_path(self.binaries_path)
+        return self._dj_layout().binaries_path(self)
 
     @api.multi
-    def burn_track(self):
-        """Search items and burn the track for the compilations."""
+    def burn_track(self, lazy=False):
+        """Search items and burn the track for the compilations.
+
+        :param lazy: CSV content is not computed right away.
+            A callable writing it to a binary file object is returned instead.
+        """
+        self.ensure_one()
+        key = self._track_cache_key()
+        if not key:
+            return self._burn_track(lazy=lazy)
+        cache = self.env['dj.track.cache']
+        tracks = cache.get_tracks(key)
+        if tracks is not None:
+            return tracks or None
+        tracks = self._burn_track(lazy=lazy)
+        if tracks:
+            # burning can create xmlids: take them into account
+            tracks = cache.store(self._track_cache_key(), tracks)
+        return tracks
+
+    def _track_cache_key(self):
+        """Return the key of the song into tracks' cache, if enabled."""
+        ctx = self.env.context
+        if (not ctx.get('dj_track_cache') or ctx.get('dj_delta') or
+                ctx.get('dj_delta_since') or ctx.get('dj_delta_baseline')):
+            return None
+        fingerprint = self._burn_fingerprint()
+        if not fingerprint:
+            return None
+        return hashlib.md5(
+            'track:{}'.format(fingerprint).encode()).hexdigest()
+
+    def _burn_track(self, lazy=False):
         self.ensure_one()
         # pass around corect xmlid module name based on compilation
         song_self = self.with_context(
             dj_xmlid_module=self.compilation_id.xmlid_module_name)
         path = data = None
         if not self.only_config and not self.scratchable():
-            path, data = song_self.make_csv()
+            if lazy:
+                path, data = self.real_csv_path(), partial(song_self.write_csv)
+            else:
+                path, data = song_self.make_csv()
         if self.scratchable():
             path, data = song_self.scratch_it()
         if path and data:
             res = [(path, data), ]
             if not self.scratchable():
                 res.extend(song_self._handle_special_fields())
+                tombstones = song_self._burn_tombstones()
+                if tombstones:
+                    res.append(tombstones)
+                if self.env.context.get('dj_delta_baseline'):
+                    song_self._store_delta_baseline()
             return res
         return None
 
+    def _get_delta_manifest(self):
+        """Return the baseline stored by last `dj_delta_baseline` burn.
+
+        :return: dictionary `{'date': ..., 'xmlids': {id: xmlid}}` or None
+        """
+        if not isinstance(self.id, int):
+            return None
+        # parsed once per burn, see `dj_delta_manifests` ctx key
+        manifests = self.env.context.get('dj_delta_manifests')
+        if manifests is not None and self.id in manifests:
+            return manifests[self.id]
+        att = self.env['ir.attachment'].sudo().search([
+            ('res_model', '=', self._name),
+            ('res_id', '=', self.id),
+            ('name', '=', DELTA_MANIFEST_NAME),
+        ], order='id desc', limit=1)
+        manifest = None
+        if att:
+            manifest = json.loads(
+                base64.b64decode(att.datas).decode('utf-8'))
+        if manifests is not None:
+            manifests[self.id] = manifest
+        return manifest
+
+    def _store_delta_baseline(self):
+        """Store current records as baseline for next delta burns."""
+        model = self.song_model
+        if not isinstance(self.id, int) or not model._log_access:
+            return
+        # same as `write_date` of records changed in this transaction
+        self.env.cr.execute("SELECT now() at time zone 'UTC'")
+        date = self.env.cr.fetchone()[0]
+        records = self._get_exportable_records().with_context(
+            **self._dj_export_context())
+        xmlids = {}
+        # by batches: do not load whole tables into the cache
+        for batch in self._export_batches(records):
+            xmlids.update(zip(map(str, batch.ids), batch._dj_export_xmlids()))
+        manifest = {
+            'date': fields.Datetime.to_string(date),
+            'xmlids': xmlids,
+        }
+        attachments = self.env['ir.attachment'].sudo()
+        attachments.search([
+            ('res_model', '=', self._name),
+            ('res_id', '=', self.id),
+            ('name', '=', DELTA_MANIFEST_NAME),
+        ]).unlink()
+        attachments.create({
+            'name': DELTA_MANIFEST_NAME,
+            'datas_fname': DELTA_MANIFEST_NAME,
+            'datas': base64.b64encode(json.dumps(manifest).encode('utf-8')),
+            'res_model': self._name,
+            'res_id': self.id,
+        })
+
+    def _get_delta_since(self):
+        """Return the date delta burns start from, if any.
+
+        It comes from `dj_delta_since` or,
+        when `dj_delta` is on, from the song's baseline.
+        """
+        model = self.song_model
+        if model is None or not model._log_access:
+            return None
+        ctx = self.env.context
+        if ctx.get('dj_delta_since'):
+            return fields.Datetime.to_datetime(ctx['dj_delta_since'])
+        if ctx.get('dj_delta'):
+            manifest = self._get_delta_manifest()
+            if manifest:
+                return fields.Datetime.to_datetime(manifest['date'])
+        return None
+
+    def _get_delta_records(self, items):
+        """Filter records changed since delta date, keeping their order.
+
+        Records whose translations changed are included
+        when the song exports translations.
+        """
+        since = self._get_delta_since()
+        if since is None or not items:
+            return items
+        ids = tuple(items.ids)
+        query = 'SELECT id FROM "{}" WHERE id IN %s AND write_date > %s'
+        params = [ids, since]
+        if self.export_translations or self.export_lang:
+            query += """
+                UNION
+                SELECT res_id FROM ir_translation
+                WHERE type IN ('model', 'model_terms') AND name LIKE %s
+                    AND res_id IN %s AND dj_write_date > %s
+            """
+            params += [items._name + ',%', ids, since]
+        self.env.cr.execute(query.format(items._table), params)
+        changed = set(x[0] for x in self.env.cr.fetchall())
+        return items.filtered(lambda x: x.id in changed)
+
+    def real_tombstones_path(self):
+        """Path of the track listing records deleted since the baseline."""
+        path, ext = os.path.splitext(self.real_csv_path())
+        return path + '.tombstones' + ext
+
+    def _has_tombstones(self):
+        return bool(
+            self.env.context.get('dj_delta') and
+            not self.only_config and not self.scratchable() and
+            self._get_delta_since() is not None and
+            self._get_delta_manifest()
+        )
+
+    def _burn_tombstones(self):
+        """Burn xmlids of records deleted since the baseline."""
+        if not self._has_tombstones():
+            return None
+        manifest = self._get_delta_manifest()
+        current = set(self._get_exportable_records().ids)
+        xmlids = [
+            [xmlid] for res_id, xmlid in sorted(
+                manifest['xmlids'].items(), key=lambda x: int(x[0]))
+            if int(res_id) not in current
+        ]
+        fp = io.BytesIO()
+        write_csv(fp, ['id'], xmlids)
+        return self.real_tombstones_path(), fp.getvalue()
+
+    @api.multi
+    def burn_translation_tracks(self, lazy=False):
+        """Burn the tracks of all the translations of the song at once.
+
+        Same tracks as translation shadow songs produce
+        (see `Compilation._add_shadow_song_translations`)
+        but records are searched once and translated values
+        are read for all the languages in one go.
+        """
+        self.ensure_one()
+        shadows = self.compilation_id._add_shadow_song_translations(self)
+        if not shadows or self.only_config or self.scratchable():
+            tracks = []
+            for shadow in shadows:
+                tracks.extend(shadow.burn_track(lazy=lazy) or [])
+            return tracks
+        shadows = shadows.with_context(
+            dj_xmlid_module=self.compilation_id.xmlid_module_name)
+        items = self._get_delta_records(self._get_exportable_records())
+        outputs = []
+        try:
+            for shadow in shadows:
+                field_names = shadow.get_csv_field_names()
+                # translated values are injected into the cache:
+                # do not read all the fields when reading other ones
+                model = items.with_context(
+                    prefetch_fields=False, **shadow._dj_export_context())
+                fp = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+                outputs.append((shadow, model, field_names, fp))
+                write_csv(fp, field_names, [])
+            self._write_translation_csvs(items, outputs)
+            tracks = []
+            for shadow, model, field_names, fp in outputs:
+                fp.seek(0)
+                if lazy:
+                    # the track owns the file: closed once written
+                    data = partial(copy_and_close, fp)
+                else:
+                    data = fp.read()
+                    fp.close()
+                tracks.append((shadow.real_csv_path(), data))
+                tracks.extend(shadow._handle_special_fields(items))
+        except Exception:
+            for __, __, __, fp in outputs:
+                fp.close()
+            raise
+        return tracks
+
+    def _write_translation_csvs(self, items, outputs):
+        """Write translated rows of `items` into `outputs` files."""
+        langs = [x[0].export_lang for x in outputs]
+        plain_names = [x.replace('/id', '') for x in outputs[0][2]]
+        for batch in self._export_batches(items):
+            translated = batch._dj_translated_values(plain_names, langs)
+            for shadow, model, field_names, fp in outputs:
+                records = model.browse(batch.ids)
+                for fname, values in translated[shadow.export_lang].items():
+                    field = records._fields[fname]
+                    for record in records:
+                        if record.id in values:
+                            records.env.cache.set(
+                                record, field, field.convert_to_cache(
+                                    values[record.id], record,
+                                    validate=False))
+                rows = records.export_data(field_names).get('datas', [])
+                write_csv(fp, None, rows)
+
+    @api.multi
+    def burn_track_incremental(self, lazy=False):
+        """Burn the song w/ its translations reusing its last tracks.
+
+        Tracks are stored as attachments of the song
+        and reused while the fingerprint of the song does not change.
+        See `_burn_fingerprint`.
+        """
+        self.ensure_one()
+        summary = self.env.context.get('dj_burn_summary')
+        fingerprint = self._burn_fingerprint()
+        if fingerprint and fingerprint == self.burn_fingerprint:
+            tracks = self._get_stored_tracks()
+            if tracks:
+                if summary is not None:
+                    summary['reused'].append(self)
+                return tracks
+        tracks = self.burn_track(lazy=lazy) or []
+        if self.export_translations:
+            tracks.extend(self.burn_translation_tracks(lazy=lazy))
+        if fingerprint and tracks:
+            # burning can create xmlids: take them into account
+            tracks = self._store_tracks(self._burn_fingerprint(), tracks)
+        if summary is not None:
+            summary['burnt'].append(self)
+        return tracks
+
+    def _burn_fingerprint(self):
+        """Compute the fingerprint of the song for incremental burns.
+
+        Used as well to look up song's tracks in tracks' cache.
+
+        It changes when song configuration, equalizers,
+        burn options or exported records change.
+        Records' changes are detected w/ their count, ids and last update,
+        along w/ the last update of their xmlids and translations
+        and the last update of related models (and their xmlids).
+
+        :return: an hash or None if the song cannot be reused
+        """
+        model = self.song_model
+        if (model is None or self.only_config or self.scratchable() or
+                not isinstance(self.id, int) or
+                not model._log_access or not model._is_an_ordinary_table()):
+            return None
+        ctx = self.env.context
+        ids = sorted(self._get_exportable_records().ids)
+        cr = self.env.cr
+        write_date = None
+        if ids:
+            cr.execute(
+                'SELECT max(write_date) FROM "{}" WHERE id IN %s'.format(
+                    model._table), (tuple(ids), ))
+            write_date = cr.fetchone()[0]
+        field_names = self.get_csv_field_names()
+        related_fields = sorted(set(
+            x.split('/')[0] for x in field_names
+            if x.split('/')[0] in model._fields and
+            model._fields[x.split('/')[0]].relational
+        ))
+        xmlids_date = None
+        related_dates = {}
+        if ids:
+            # new xmlids are caught by their ID, deleted ones by the count
+            cr.execute("""
+                SELECT count(*), max(id), max(write_date) FROM ir_model_data
+                WHERE model = %s AND res_id IN %s
+            """, (model._name, tuple(ids)))
+            xmlids_date = list(cr.fetchone())
+            related_dates = {
+                fname: self._related_stats(model, fname, ids)
+                for fname in related_fields
+            }
+        translations_date = None
+        if self.export_translations:
+            cr.execute("""
+                SELECT max(dj_write_date) FROM ir_translation
+                WHERE name LIKE %s
+            """, (model._name + ',%', ))
+            translations_date = cr.fetchone()[0]
+        related = sorted(set(
+            model._fields[x[:-len('/id')]].comodel_name
+            for x in field_names if x.endswith('/id')
+        ))
+        data = {
+            'song': self.copy_data()[0],
+            'paths': [self.real_csv_path(), self.real_binaries_path()],
+            'module': self.compilation_id.xmlid_module_name,
+            'data_mode': self.compilation_id.data_mode,
+            'fields': field_names,
+            'equalizers': {
+                name: self.env[name]._dj_global_config()
+                for name in [model._name] + related if name in self.env
+            },
+            'langs': [
+                x[0] for x in self.compilation_id._get_installed_langs()
+            ] if self.export_translations else [],
+            'options': {
+                k: ctx.get(k)
+                for k in self.compilation_id.dj_burn_options_flags
+                if k not in (
+                    'dj_incremental', 'dj_burn_workers', 'dj_track_cache')
+            },
+            'skip_special_fields': ctx.get('dj_read_skip_special_fields'),
+            'lang': ctx.get('lang'),
+            'count': len(ids),
+            'ids': hashlib.md5(
+                ','.join(map(str, ids)).encode()).hexdigest(),
+            'write_date': write_date,
+            'xmlids_date': xmlids_date,
+            'related_dates': related_dates,
+            'translations_date': translations_date,
+        }
+        return hashlib.md5(json.dumps(
+            data, sort_keys=True, default=str).encode()).hexdigest()
+
+    def _related_stats(self, model, fname, ids):
+        """Return last updates of records related to `ids` via `fname`.
+
+        Last update of related records and of their xmlids
+        are read straight from SQL: records are not loaded.
+        """
+        cr = self.env.cr
+        field = model._fields[fname]
+        while field.inherited:
+            # go up to the parent record holding the value
+            parent_fname = field.related[0]
+            cr.execute('SELECT "{}" FROM "{}" WHERE id IN %s'.format(
+                parent_fname, model._table), (tuple(ids), ))
+            ids = [x[0] for x in cr.fetchall() if x[0]]
+            model = self.env[model._fields[parent_fname].comodel_name]
+            field = model._fields[fname]
+            if not ids:
+                return None
+        comodel = self.env[field.comodel_name]
+        if not comodel._is_an_ordinary_table():
+            return None
+        params = [comodel._name]
+        if field.type == 'many2one' and field.store:
+            related_ids = 'SELECT "{}" FROM "{}" WHERE id IN %s'.format(
+                fname, model._table)
+            params.append(tuple(ids))
+        elif field.type == 'many2many' and field.store:
+            related_ids = 'SELECT "{}" FROM "{}" WHERE "{}" IN %s'.format(
+                field.column2, field.relation, field.column1)
+            params.append(tuple(ids))
+        elif (field.type == 'one2many' and
+                comodel._fields[field.inverse_name].store):
+            related_ids = 'SELECT id FROM "{}" WHERE "{}" IN %s'.format(
+                comodel._table, field.inverse_name)
+            params.append(tuple(ids))
+        else:
+            # not stored: any change of the related model counts
+            related_ids = 'SELECT id FROM "{}"'.format(comodel._table)
+        cr.execute("""
+            SELECT {}, count(d.id), max(d.id), max(d.write_date)
+            FROM "{}" c
+            LEFT JOIN ir_model_data d ON d.model = %s AND d.res_id = c.id
+            WHERE c.id IN ({})
+        """.format(
+            'max(c.write_date)' if comodel._log_access else 'NULL',
+            comodel._table, related_ids), params)
+        return list(cr.fetchone())
+
+    def _get_stored_attachments(self):
+        return self.env['ir.attachment'].sudo().search([
+            ('res_model', '=', self._name),
+            ('res_id', '=', self.id),
+            ('res_field', '=', False),
+            ('name', '!=', DELTA_MANIFEST_NAME),
+        ], order='id')
+
+    def _get_stored_tracks(self):
+        """Return tracks stored by last incremental burn."""
+        return [
+            (att.datas_fname, base64.b64decode(att.datas))
+            for att in self._get_stored_attachments()
+        ]
+
+    def _store_tracks(self, fingerprint, tracks):
+        """Store tracks for next incremental burns and return them."""
+        self._get_stored_attachments().unlink()
+        tracks = materialize_tracks(tracks)
+        for path, data in tracks:
+            self.env['ir.attachment'].sudo().create({
+                'name': os.path.basename(path),
+                'datas_fname': path,
+                'datas': base64.b64encode(data),
+                'res_model': self._name,
+                'res_id': self.id,
+            })
+        self.sudo().write({'burn_fingerprint': fingerprint})
+        return tracks
+
     def scratchable(self):
         """Tell you if the song is scratchable.
 
@@ -522,17 +961,13 @@ class Song(models.Model):
                 exclude.append(fname + '/id')
         return [x for x in exclude if x in self.get_csv_field_names()]
 
-    @tools.ormcache_context('self', 'key', keys=('dj_xmlid_force'))
     def _dj_global_config(self, key=None):
         """Retrieve default global config for song model."""
         model = self.model_name
         if self.env.context.get('dj_xmlid_force'):
             # we are exporting the dj.song itself
             model = self._name
-        config = self.env['dj.equalizer'].search([
-            ('model', '=', model),
-        ], limit=1)
-        return config.get_conf(key)
+        return self.env['dj.equalizer'].get_model_conf(model, key)
 
     def _get_xmlid_fields(self, include_global=False):
         """Retrieve fields to generate xmlids."""
@@ -558,6 +993,53 @@ class Song(models.Model):
             xmlid_fields_map[song.model_name] = song._get_xmlid_fields()
         return xmlid_fields_map
 
+    def _get_xmlid_models(self):
+        """Retrieve models whose xmlids are exported by this song."""
+        model = self.song_model
+        if model is None or self.only_config or self.scratchable():
+            return set()
+        res = set()
+        if not model._transient:
+            res.add(model._name)
+        for fname in self.get_csv_field_names():
+            if not fname.endswith('/id'):
+                continue
+            field = model._fields.get(fname[:-len('/id')])
+            if field is not None and field.relational:
+                res.add(field.comodel_name)
+        return res
+
+    def _get_xmlid_records(self):
+        """Retrieve records whose xmlids are exported by this song.
+
+        :return: dictionary {model name: set of ids}
+        """
+        res = defaultdict(set)
+        if not self._get_xmlid_models():
+            return res
+        model = self.song_model
+        records = self._get_exportable_records()
+        if not model._transient:
+            res[model._name].update(records.ids)
+        field_names = self.get_csv_field_names()
+        related = []
+        for fname in field_names:
+            if not fname.endswith('/id'):
+                continue
+            fname = fname[:-len('/id')]
+            field = model._fields.get(fname)
+            if field is not None and field.relational:
+                related.append((fname, field.comodel_name))
+        # by batches: do not load whole tables into the cache
+        for batch in self._export_batches(records):
+            for fname, comodel_name in related:
+                res[comodel_name].update(batch.mapped(fname).ids)
+            # records referenced by values (properties, defaults)
+            values = batch._dj_xmlid_value_records(field_names)
+            for model_name, ids in values.items():
+                res[model_name].update(ids)
+        return res
+
     def _get_exportable_records(self, order=None):
         if self.song_model is None:
             return []
@@ -597,7 +1079,8 @@ class Song(models.Model):
         extra_tracks = []
         if self.env.context.get('dj_read_skip_special_fields'):
             return extra_tracks
-        items = items or self._get_exportable_records()
+        items = self._get_delta_records(
+            items or self._get_exportable_records())
         if self.song_model is None:
             return
         song_model = self.song_model.with_context(
@@ -605,36 +1088,76 @@ class Song(models.Model):
         )
         special = song_model._dj_special_fields()
         for fname, info in special:
-            for rec in items:
-                if self.export_lang:
-                    rec = rec.with_context(lang=self.export_lang)
-                content = rec[fname]
-                if not content:
-                    continue
-                path = song_model._dj_file_to_path(rec, fname, bare_path=True)
-                fs_content = self.song_model._dj_file_content_to_fs(
-                    fname, rec, info=info)
-                extra_tracks.append((path, fs_content))
+            for batch in self._export_batches(items):
+                for rec in batch:
+                    if self.export_lang:
+                        rec = rec.with_context(lang=self.export_lang)
+                    content = rec[fname]
+                    if not content:
+                        continue
+                    path = song_model._dj_file_to_path(
+                        rec, fname, bare_path=True)
+                    fs_content = self.song_model._dj_file_content_to_fs(
+                        fname, rec, info=info)
+                    extra_tracks.append((path, fs_content))
         return extra_tracks
 
+    def _export_batches(self, items):
+        """Yield slices of `items` keeping their order.
+
+        Cached values of exported and related models are cleared
+        after each slice hence prefetched values do not pile up for big songs.
+        The rest of the cache is preserved: shadow songs live only there.
+        """
+        model_names = {items._name} | {
+            f.comodel_name for f in items._fields.values() if f.relational
+        }
+        model_names.discard(self._name)
+        spec = [
+            (field, None)
+            for model_name in model_names
+            for field in self.env[model_name]._fields.values()
+        ]
+        ids = items.ids
+        for i in range(0, len(ids), EXPORT_BATCH_SIZE):
+            batch = items.browse(ids[i:i + EXPORT_BATCH_SIZE])
+            yield batch
+            self.env.cache.invalidate(spec)
+
     def make_csv(self, items=None):
         """Create the csv and return path and content."""
-        items = items or self._get_exportable_records()
+        fp = io.BytesIO()
+        self.write_csv(fp, items=items)
+        return (self.real_csv_path(), fp.getvalue())
+
+    def write_csv(self, fp, items=None):
+        """Stream the csv content to given binary file object.
+
+        When all the fields are plain columns
+        the content is produced straight from SQL.
+        See `Base._dj_export_sql_supported`.
+        """
+        items = self._get_delta_records(
+            items or self._get_exportable_records())
         field_names = self.get_csv_field_names()
-        export_data = items.with_context(
-            **self._dj_export_context()
-        ).export_data(field_names).get('datas', [])
-        csv_data = csv_from_data(field_names, export_data)
-        # get bytes, convert to string, cleanup, convert back to bytes
-        csv_data = str(
-            csv_data, 'utf-8'
-        ).replace('\r\n', '\n').replace('^M', '\n')
-        return (self.real_csv_path(), csv_data.encode())
+        model = items.with_context(**self._dj_export_context())
+        if model._dj_export_sql_supported(field_names):
+            # header only
+            write_csv(fp, field_names, [])
+            for batch in self._export_batches(model):
+                batch._dj_export_sql_csv(field_names, fp)
+            return
+        write_csv(fp, field_names, self._csv_rows(items, field_names))
+
+    def _csv_rows(self, items, field_names):
+        """Yield exported rows for given records, batch by batch."""
+        items = items.with_context(**self._dj_export_context())
+        for batch in self._export_batches(items):
+            for row in batch.export_data(field_names).get('datas', []):
+                yield row
 
     def anthem_path(self):
-        path = self.compilation_id.disc_full_path(
-        ).replace('/', '.').replace('.py', '')
-        return '{}::{}'.format(path, self.name)
+        return self._dj_layout().anthem_path(self.name)
 
     settings_char_fields = ('char', 'date', 'datetime')
     settings_text_fields = ('text', )
@@ -3,10 +3,61 @@
 
 import jinja2
 import os
+import threading
 
 from odoo import models, fields, api, _
 from odoo.modules.module import get_module_resource
-from ...utils import to_str
+from ...utils import to_str, pep8_call
+
+
+class ModuleLoader(jinja2.BaseLoader):
+    """Load templates named `module:path/to/template` from Odoo modules.
+
+    Templates are reloaded when their file's mtime changes.
+    """
+
+    def get_source(self, environment, template):
+        if ':' not in template:
+            raise jinja2.TemplateNotFound(template)
+        mod, path = template.split(':', 1)
+        filepath = get_module_resource(mod, path)
+        if not filepath:
+            raise jinja2.TemplateNotFound(template)
+        mtime = os.path.getmtime(filepath)
+        with open(filepath, 'rb') as fd:
+            source = fd.read().decode('utf-8')
+
+        def uptodate():
+            try:
+                return os.path.getmtime(filepath) == mtime
+            except OSError:
+                return False
+
+        return source, filepath, uptodate
+
+
+_jinja_env = None
+_jinja_env_lock = threading.Lock()
+
+
+def get_jinja_env():
+    """Return the process wide Jinja environment.
+
+    Compiled templates are kept in memory and their bytecode on disk,
+    so that each template is compiled once.
+    """
+    global _jinja_env
+    with _jinja_env_lock:
+        if _jinja_env is None:
+            _jinja_env = jinja2.Environment(
+                loader=ModuleLoader(),
+                auto_reload=True,
+                bytecode_cache=jinja2.FileSystemBytecodeCache(
+                    pattern='__base_dj_%s.cache'),
+            )
+            # templates render PEP8 compliant code
+            _jinja_env.globals['pep8_call'] = pep8_call
+        return _jinja_env
 
 
 class TemplateMixin(models.AbstractModel):
@@ -32,16 +83,10 @@ class TemplateMixin(models.AbstractModel):
         """Retrieve Jinja template."""
         self.ensure_one()
         path = path or self.template_path
-        # load Jinja template
-        mod, filepath = path.split(':')
-        filepath = get_module_resource(mod, filepath)
-        if not filepath:
-            raise LookupError(
-                _('Template not found: `%s`') % self.template_path)
-        path, filename = os.path.split(filepath)
-        return jinja2.Environment(
-            loader=jinja2.FileSystemLoader(path)
-        ).get_template(filename)
+        try:
+            return get_jinja_env().get_template(path)
+        except jinja2.TemplateNotFound:
+            raise LookupError(_('Template not found: `%s`') % path)
 
     def dj_render_template(self, template_vars=None):
         """Render template."""
@@ -0,0 +1,164 @@
+# Copyright 2017 Camptocamp SA
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl)
+
+from odoo import models, fields, api, tools
+import base64
+import logging
+import os
+
+from ...utils import materialize_tracks
+from ...config import TRACK_CACHE_MAX_SIZE, TRACK_CACHE_MAX_SIZE_PARAM
+
+_logger = logging.getLogger(__name__)
+
+
+class TrackCache(models.Model):
+    """Cache burnt tracks by a hash of their inputs.
+
+    Tracks are stored as attachments of the cache entry.
+    When the total size of the cache exceeds its limit
+    least recently used entries are evicted.
+    """
+
+    _name = 'dj.track.cache'
+    _order = 'last_access desc, id desc'
+
+    key = fields.Char(required=True, index=True, readonly=True)
+    size = fields.Integer(readonly=True, help='Size of all tracks in bytes')
+    track_count = fields.Integer(readonly=True)
+    hit_count = fields.Integer(readonly=True)
+    last_access = fields.Datetime(readonly=True, index=True)
+
+    _sql_constraints = [
+        ('key_uniq', 'unique(key)', 'Cache key must be unique.'),
+    ]
+
+    def _get_attachments(self):
+        return self.env['ir.attachment'].sudo().search([
+            ('res_model', '=', self._name),
+            ('res_id', 'in', self.ids),
+        ], order='id')
+
+    @api.model
+    def get_tracks(self, key):
+        """Return cached tracks for `key` or None."""
+        entry = self.sudo().search([('key', '=', key)], limit=1)
+        if not entry:
+            return None
+        # plain SQL: do not touch `write_date` and keep it cheap
+        self.env.cr.execute("""
+            UPDATE dj_track_cache
+            SET hit_count = hit_count + 1, last_access = %s
+            WHERE id = %s
+        """, (fields.Datetime.now(), entry.id))
+        entry.invalidate_cache(['hit_count', 'last_access'], entry.ids)
+        return [
+            (att.datas_fname, base64.b64decode(att.datas))
+            for att in entry._get_attachments()
+        ]
+
+    @api.model
+    def store(self, key, tracks):
+        """Store `tracks` for `key` and return them w/ their content.
+
+        Tracks stored meanwhile by a concurrent burn are kept as they are.
+        """
+        tracks = materialize_tracks(tracks)
+        now = fields.Datetime.now()
+        # plain SQL: a duplicated key must not abort the burn
+        self.env.cr.execute("""
+            INSERT INTO dj_track_cache
+                (key, size, track_count, hit_count, last_access,
+                 create_uid, create_date, write_uid, write_date)
+            VALUES (%s, %s, %s, 0, %s, %s, %s, %s, %s)
+            ON CONFLICT (key) DO NOTHING
+            RETURNING id
+        """, (key, sum(len(data) for __, data in tracks), len(tracks), now,
+              self.env.uid, now, self.env.uid, now))
+        row = self.env.cr.fetchone()
+        if row is None:
+            return tracks
+        entry = self.sudo().browse(row[0])
+        for path, data in tracks:
+            self.env['ir.attachment'].sudo().create({
+                'name': os.path.basename(path),
+                'datas_fname': path,
+                'datas': base64.b64encode(data),
+                'res_model': self._name,
+                'res_id': entry.id,
+            })
+        self._evict()
+        return tracks
+
+    @api.model
+    def _get_max_size(self):
+        return int(self.env['ir.config_parameter'].sudo().get_param(
+            TRACK_CACHE_MAX_SIZE_PARAM, TRACK_CACHE_MAX_SIZE))
+
+    @api.model
+    def _evict(self):
+        """Drop least recently used entries exceeding cache max size."""
+        max_size = self._get_max_size()
+        self.env.cr.execute("""
+            SELECT id FROM (
+                SELECT id, sum(size) OVER (
+                    ORDER BY last_access DESC, id DESC
+                ) AS total
+                FROM dj_track_cache
+            ) AS entries
+            WHERE total > %s
+        """, (max_size, ))
+        ids = [x[0] for x in self.env.cr.fetchall()]
+        if ids:
+            _logger.info('Track cache: evicting %d entries', len(ids))
+            self.sudo().browse(ids).unlink()
+
+    @api.multi
+    def unlink(self):
+        self._get_attachments().unlink()
+        return super().unlink()
+
+    @api.model
+    def clear(self):
+        self.sudo().search([]).unlink()
+
+
+class TrackCacheStats(models.TransientModel):
+    """Show track cache usage."""
+
+    _name = 'dj.track.cache.stats'
+
+    entry_count = fields.Integer(compute='_compute_stats')
+    track_count = fields.Integer(compute='_compute_stats')
+    hits = fields.Integer(compute='_compute_stats')
+    misses = fields.Integer(
+        compute='_compute_stats',
+        help='Every cache entry has been stored after a miss.',
+    )
+    hit_rate = fields.Float(compute='_compute_stats', help='Percentage')
+    size = fields.Char(string='Disk used', compute='_compute_stats')
+    max_size = fields.Char(compute='_compute_stats')
+
+    @api.depends()
+    def _compute_stats(self):
+        cache = self.env['dj.track.cache']
+        self.env.cr.execute("""
+            SELECT count(*), coalesce(sum(track_count), 0),
+                coalesce(sum(hit_count), 0), coalesce(sum(size), 0)
+            FROM dj_track_cache
+        """)
+        entries, tracks, hits, size = self.env.cr.fetchone()
+        for item in self:
+            item.entry_count = entries
+            item.track_count = tracks
+            item.hits = hits
+            item.misses = entries
+            item.hit_rate = (
+                100.0 * hits / (hits + entries) if hits + entries else 0.0)
+            item.size = tools.human_size(size)
+            item.max_size = tools.human_size(cache._get_max_size())
+
+    @api.multi
+    def action_clear(self):
+        self.env['dj.track.cache'].clear()
+        return True
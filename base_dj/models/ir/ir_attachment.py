@@ -0,0 +1,65 @@
+# Copyright 2017 Camptocamp SA
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+from odoo import models, api
+import base64
+import hashlib
+import io
+import mimetypes
+import os
+import shutil
+
+
+class IrAttachment(models.Model):
+
+    _inherit = 'ir.attachment'
+
+    @api.model
+    def dj_create_from_file(self, fileobj, vals):
+        """Create an attachment w/ the content of binary `fileobj`.
+
+        With file storage the content is copied as it is to the filestore:
+        no base64 round trip nor whole content in memory.
+        """
+        fname = vals.get('datas_fname') or vals.get('name')
+        vals = dict(
+            vals,
+            type='binary',
+            mimetype=mimetypes.guess_type(fname)[0] or
+            'application/octet-stream',
+        )
+        fileobj.seek(0)
+        if self._storage() != 'file':
+            return self.create(dict(
+                vals, datas=base64.b64encode(fileobj.read())))
+        digest = hashlib.sha1()
+        size = 0
+        for chunk in iter(lambda: fileobj.read(1024 * 1024), b''):
+            digest.update(chunk)
+            size += len(chunk)
+        checksum = digest.hexdigest()
+        store_fname, full_path = self._get_path(None, checksum)
+        if not os.path.isfile(full_path):
+            fileobj.seek(0)
+            with open(full_path, 'wb') as fd:
+                shutil.copyfileobj(fileobj, fd)
+            # dropped by filestore GC if this transaction is rolled back
+            self._mark_for_gc(store_fname)
+        attachment = self.create(vals)
+        # `file_size` and `checksum` are dropped by `create`
+        self.env.cr.execute("""
+            UPDATE ir_attachment
+            SET store_fname = %s, file_size = %s, checksum = %s
+            WHERE id = %s
+        """, (store_fname, size, checksum, attachment.id))
+        attachment.invalidate_cache(
+            ['store_fname', 'file_size', 'checksum'], attachment.ids)
+        return attachment
+
+    @api.multi
+    def dj_open(self):
+        """Return a binary file object reading attachment's content."""
+        self.ensure_one()
+        if self.store_fname:
+            return open(self._full_path(self.store_fname), 'rb')
+        return io.BytesIO(base64.b64decode(self.datas or b''))
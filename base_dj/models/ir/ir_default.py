@@ -9,12 +9,15 @@ from ...utils import (
     string_to_list,
 )
 from odoo.tools import pickle
+from collections import defaultdict
 import json
 
 
 class DefaultMixin(models.AbstractModel):
     _name = 'default.mixin'
     _value_key = 'value'
+    # values are converted on read
+    _dj_export_sql_fast_path = False
 
     @api.model
     def create(self, vals):
@@ -91,14 +94,27 @@ class IRDefault(models.Model):
                     values = values[0]
                 vals[self._value_key] = json.dumps(values)
 
+    def _dj_xmlid_value_records(self, field_names):
+        res = defaultdict(set)
+        if self._value_key not in field_names:
+            return res
+        for rec in self:
+            field = self._dj_get_relation_field(rec.field_id.id)
+            if not field or not rec[self._value_key]:
+                continue
+            rec_ids = json.loads(rec[self._value_key])
+            if not isinstance(rec_ids, list):
+                rec_ids = [rec_ids]
+            res[field.relation].update(x for x in rec_ids if x)
+        return res
+
     def _dj_value_to_xmlid(self, field, rec):
         value = rec[self._value_key]
         rec_ids = json.loads(value)
         model = self.env[field['relation']]
         if rec_ids:
             if isinstance(rec_ids, list):
-                value = ','.join([model.browse(rec_id)._dj_export_xmlid()
-                                    for rec_id in rec_ids])
+                value = ','.join(model.browse(rec_ids)._dj_export_xmlids())
             else:
                 value = model.browse(rec_ids)._dj_export_xmlid()
         return value
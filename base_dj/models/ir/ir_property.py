@@ -3,6 +3,7 @@
 
 from odoo import models, api
 from ...utils import property_to_xmlid, xmlid_to_property
+from collections import defaultdict
 
 
 class Property(models.Model):
@@ -10,6 +11,8 @@ class Property(models.Model):
     _inherit = 'ir.property'
     # these fields come in the form `model,ID`
     _property_like_fields_to_update = ('value_reference', 'res_id', )
+    # values are converted on read
+    _dj_export_sql_fast_path = False
 
     @api.multi
     def _update_values(self, values):
@@ -20,6 +23,17 @@ class Property(models.Model):
                     values[fname] = xmlid_to_property(self.env, values[fname])
         return super(Property, self)._update_values(values)
 
+    def _dj_xmlid_value_records(self, field_names):
+        res = defaultdict(set)
+        fnames = [x for x in self._property_like_fields_to_update
+                  if x in field_names]
+        for rec in self:
+            for fname in fnames:
+                if rec[fname]:
+                    model, res_id = rec[fname].split(',')
+                    res[model].add(int(res_id))
+        return res
+
     @api.multi
     def read(self, fields=None, load='_classic_read'):
         """Convert property values to xmlid."""
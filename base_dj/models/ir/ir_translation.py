@@ -0,0 +1,40 @@
+# Copyright 2017 Camptocamp SA
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+from odoo import models, fields, api
+
+
+class IrTranslation(models.Model):
+
+    _inherit = 'ir.translation'
+
+    # translations have no `write_date` and are mostly written via SQL:
+    # a trigger keeps this one up to date for delta and incremental burns
+    dj_write_date = fields.Datetime(readonly=True, index=True)
+
+    @api.model_cr_context
+    def _auto_init(self):
+        res = super()._auto_init()
+        self.env.cr.execute("""
+            CREATE OR REPLACE FUNCTION dj_translation_write_date()
+            RETURNS trigger AS $$
+            BEGIN
+                NEW.dj_write_date := now() at time zone 'UTC';
+                RETURN NEW;
+            END;
+            $$ LANGUAGE plpgsql;
+            DROP TRIGGER IF EXISTS dj_translation_write_date
+                ON ir_translation;
+            CREATE TRIGGER dj_translation_write_date
+                BEFORE INSERT OR UPDATE ON ir_translation
+                FOR EACH ROW EXECUTE PROCEDURE dj_translation_write_date();
+        """)
+        return res
+
+
+def drop_translation_trigger(cr):
+    """Drop the trigger: `dj_write_date` column goes away w/ the module."""
+    cr.execute("""
+        DROP TRIGGER IF EXISTS dj_translation_write_date ON ir_translation;
+        DROP FUNCTION IF EXISTS dj_translation_write_date();
+    """)
@@ -0,0 +1,75 @@
+# Copyright 2017 Camptocamp SA
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl)
+
+import logging
+import multiprocessing
+
+import odoo
+from odoo import api
+
+_logger = logging.getLogger(__name__)
+
+# burn state inherited by forked workers
+_state = {}
+
+
+def burn_songs(compilations, songs, workers):
+    """Burn `songs` of `compilations` using a pool of `workers` processes.
+
+    Only for burn jobs, run by the cron: never fork HTTP workers.
+    All the workers read the database through the same snapshot
+    exported by current transaction. Exported snapshots do not include
+    the changes of the exporting transaction: commit them before.
+
+    :return: list of tracks for each song, in the same order as `songs`.
+    """
+    env = compilations.env
+    env.cr.execute('SELECT pg_export_snapshot()')
+    snapshot = env.cr.fetchone()[0]
+    _state.update({
+        'dbname': env.cr.dbname,
+        'uid': env.uid,
+        'context': dict(env.context),
+        'compilation_ids': compilations.ids,
+        'song_count': len(songs),
+        'snapshot': snapshot,
+    })
+    _logger.info('Burning %d songs w/ %d workers', len(songs), workers)
+    # workers inherit loaded registry and burn state
+    mp_context = multiprocessing.get_context('fork')
+    try:
+        with mp_context.Pool(workers, initializer=_init_worker) as pool:
+            return pool.map(_burn_song, range(len(songs)), chunksize=1)
+    finally:
+        _state.clear()
+
+
+def _init_worker():
+    """Open a cursor on the shared snapshot for the whole worker life.
+
+    Connections inherited from the parent are left untouched:
+    the worker opens its own one.
+    """
+    dbname, info = odoo.sql_db.connection_info_for(_state['dbname'])
+    pool = odoo.sql_db.ConnectionPool(1)
+    cr = odoo.sql_db.Connection(pool, dbname, info).cursor()
+    cr.execute('SET TRANSACTION SNAPSHOT %s', (_state['snapshot'], ))
+    # workers are read only: missing xmlids are refused
+    # and neither tracks' cache nor ID sets are stored
+    context = dict(_state['context'],
+                   dj_xmlid_readonly=True, dj_track_cache=False,
+                   dj_id_sets=False)
+    resolver = context.get('dj_xid_resolver')
+    if resolver is not None:
+        # inherited copy, already loaded by the parent
+        resolver.cr = cr
+    env = api.Environment(cr, _state['uid'], context)
+    songs = env['dj.compilation'].browse(
+        _state['compilation_ids'])._get_all_songs()
+    if len(songs) != _state['song_count']:
+        raise RuntimeError('Songs differ between burn workers and parent.')
+    _state['songs'] = songs
+
+
+def _burn_song(index):
+    return _state['songs'][index].burn_track() or []
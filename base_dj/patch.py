@@ -18,7 +18,7 @@ def _RelationalMulti__convert_to_export(self, value, record):
     """We want to export the xmldids, not display value."""
     if not record.env.context.get('dj_export'):
         return self.orig_convert_to_export(value, record)
-    return ','.join([x._export_xml_id() for x in value])
+    return ','.join(value._dj_export_xmlids())
 
 
 def patch_fields():
@@ -0,0 +1,61 @@
+# Copyright 2017 Camptocamp SA
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl)
+
+
+class BurnCancelled(Exception):
+    """Raised when a burn job is cancelled while burning."""
+
+
+class BurnProgress(object):
+    """Report songs burnt by a burn job.
+
+    Progress is written w/ a separate cursor and committed right away
+    to be visible while burning. Cancellation is checked at each step,
+    hence between songs.
+    """
+
+    def __init__(self, env, job_id):
+        self.registry = env.registry
+        self.job_id = job_id
+        self.total = 0
+        self.done = 0
+
+    def start(self, total):
+        self.total = total
+        self.done = 0
+        self._update(None)
+
+    def track(self, song, tracks):
+        """Return `tracks` of `song` reporting progress once written.
+
+        Lazy tracks are burnt only when written:
+        the step is reported then.
+        """
+        tracks = list(tracks or [])
+        if not tracks or not callable(tracks[0][1]):
+            self.step(song)
+            return tracks
+        path, data = tracks[0]
+
+        def writer(fp):
+            self.step(song)
+            data(fp)
+
+        tracks[0] = (path, writer)
+        return tracks
+
+    def step(self, song):
+        self.done += 1
+        self._update('{}: {}'.format(song.compilation_id.name, song.name))
+
+    def _update(self, current):
+        with self.registry.cursor() as cr:
+            cr.execute("""
+                UPDATE dj_burn_job
+                SET song_count = %s, song_done = %s, current_song = %s
+                WHERE id = %s
+                RETURNING cancel_requested
+            """, (self.total, self.done, current, self.job_id))
+            row = cr.fetchone()
+        if row and row[0]:
+            raise BurnCancelled()
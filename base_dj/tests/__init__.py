@@ -4,3 +4,5 @@ from . import test_xmlid
 from . import test_defaults
 from . import test_song_addons
 from . import test_special_fields
+from . import test_burn_job
+from . import test_utils
@@ -7,7 +7,7 @@ from odoo.modules.module import get_resource_path
 import difflib
 import io
 
-from .lint import run_pylint
+from .lint import run_pylint, run_pycodestyle
 from .xml_compare import xml_compare
 from ..utils import to_str
 
@@ -65,6 +65,9 @@ class BaseCase(SavepointCase):
     def _pylint_report(self, filepath):
         return run_pylint(filepath)
 
+    def _pycodestyle_report(self, filepath):
+        return run_pycodestyle(filepath)
+
     def assertMultiLineEqual(self, first, second, msg=None):
         """Assert that two multi-line strings are equal.
 
@@ -123,6 +126,8 @@ class BaseCompilationCase(BaseCase):
 
         lint_errors = self._pylint_report(tmp_file_path)
         self.assertFalse(lint_errors)
+        # discs are PEP8 compliant w/out autopep8
+        self.assertFalse(self._pycodestyle_report(tmp_file_path))
 
     def _burn_and_test(self, fixture, expected_path, compilation):
         # load fixture
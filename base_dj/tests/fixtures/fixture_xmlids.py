@@ -0,0 +1,30 @@
+# Copyright  Camptocamp SA
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl)
+# -- This file has been generated --
+
+# pylint: disable=C,E
+
+import anthem
+
+
+@anthem.log
+def add_xmlid_to_existing_res_partner_category(ctx):
+    # this works if `base_dj` is installed
+    model = ctx.env['res.partner.category'].with_context(
+        dj_xmlid_fields_map={
+            'res.partner.category': ['name']},
+        dj_multicompany=False,
+    )
+    ids = model.search([]).ids
+    chunk_size = 5000
+    for i in range(0, len(ids), chunk_size):
+        model.browse(ids[i:i + chunk_size])._dj_export_xmlids()
+        ctx.env.cr.commit()
+        model.invalidate_cache()
+        ctx.log_line('xmlids: %d/%d records' % (
+            min(i + chunk_size, len(ids)), len(ids)))
+
+
+@anthem.log
+def post(ctx):
+    add_xmlid_to_existing_res_partner_category(ctx)
@@ -4,6 +4,7 @@
 # tnx to https://stackoverflow.com/questions/2028268/
 
 import json
+import pycodestyle
 from pylint import epylint as lint
 
 
@@ -16,3 +17,11 @@ def run_pylint(filepath):
         # something wrong to be linted
         return json.loads(out)
     return None
+
+
+def run_pycodestyle(filepath):
+    """Run pycodestyle on the given filepath and return found errors."""
+    report = pycodestyle.StyleGuide(quiet=True).check_files([filepath])
+    if report.total_errors:
+        return report.get_statistics()
+    return None
@@ -0,0 +1,155 @@
+# Copyright 2017 Camptocamp SA
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html)
+
+from . common import BaseCompilationCase
+from ..progress import BurnProgress, BurnCancelled
+from ..config import BURN_JOB_LOCK_KEY
+from odoo import fields
+import base64
+import io
+import zipfile
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+BURN_SONGS_PATH = 'odoo.addons.base_dj.models.dj.dj_compilation.burn_songs'
+
+
+def burn_songs_inline(compilations, songs, workers):
+    return [song.burn_track() or [] for song in songs]
+
+
+class BurnJobCase(BaseCompilationCase):
+
+    def setUp(self):
+        super().setUp()
+        self._load_xml('base_dj', 'tests/fixtures/fixture_comp1.xml')
+        self.comp = self.env.ref('base_dj.test_comp1').with_context(
+            dj_read_skip_special_fields=True)
+
+    def test_burn_progress(self):
+        progress = BurnProgress(self.env, 0)
+        steps = []
+        with patch.object(BurnProgress, '_update',
+                          side_effect=lambda current: steps.append(current)):
+            self.comp.with_context(
+                dj_burn_progress=progress).burn_to_file(io.BytesIO())
+        self.assertEqual(progress.total, len(self.comp.song_ids))
+        self.assertEqual(progress.done, progress.total)
+        # start + one step per song
+        self.assertEqual(len(steps), progress.total + 1)
+        self.assertIsNone(steps[0])
+
+    def test_burn_cancel(self):
+        progress = BurnProgress(self.env, 0)
+
+        def update(current):
+            if progress.done:
+                raise BurnCancelled()
+
+        with patch.object(BurnProgress, '_update', side_effect=update):
+            with self.assertRaises(BurnCancelled):
+                self.comp.with_context(
+                    dj_burn_progress=progress).burn_to_file(io.BytesIO())
+        self.assertEqual(progress.done, 1)
+
+    def test_job_run(self):
+        job = self.env['dj.burn.job'].create_for(
+            self.comp, options={'dj_exclude_core': True})
+        self.assertEqual(job.state, 'pending')
+        with patch.object(BurnProgress, '_update'), \
+                patch.object(self.env.cr, 'commit'):
+            job.with_context(dj_read_skip_special_fields=True)._run()
+        self.assertEqual(job.state, 'done')
+        self.assertEqual(job.progress, 100.0)
+        content = base64.b64decode(job.attachment_id.datas)
+        with zipfile.ZipFile(io.BytesIO(content)) as zf:
+            self.assertIn(self.comp.disc_full_path(), zf.namelist())
+        self.assertEqual(job.action_download()['type'], 'ir.actions.act_url')
+
+    def test_burn_workers_direct(self):
+        """Direct burns never fork workers nor commit."""
+        with patch(BURN_SONGS_PATH) as burn_songs, \
+                patch.object(self.env.cr, 'commit') as commit:
+            self.comp.with_context(
+                dj_burn_workers=4, dj_exclude_core=True,
+            ).burn_to_file(io.BytesIO())
+        burn_songs.assert_not_called()
+        commit.assert_not_called()
+
+    def test_job_run_parallel(self):
+        job = self.env['dj.burn.job'].create_for(
+            self.comp, options={'dj_exclude_core': True,
+                                'dj_burn_workers': 2})
+        calls = []
+
+        def burn_prepare(comps):
+            calls.append('prepare')
+
+        def commit():
+            calls.append('commit')
+
+        def burn_songs(compilations, songs, workers):
+            calls.append(('burn', workers))
+            return burn_songs_inline(compilations, songs, workers)
+
+        with patch.object(BurnProgress, '_update'), \
+                patch.object(self.env.cr, 'commit', side_effect=commit), \
+                patch.object(type(self.comp), 'burn_prepare',
+                             autospec=True, side_effect=burn_prepare), \
+                patch(BURN_SONGS_PATH, side_effect=burn_songs):
+            job.with_context(dj_read_skip_special_fields=True)._run()
+        self.assertEqual(job.state, 'done', job.error)
+        # xmlids are prepared and committed before forking workers
+        self.assertEqual(calls[:4], ['commit', 'prepare', 'commit',
+                                     ('burn', 2)])
+
+    def test_job_run_parallel_refused(self):
+        for option in ('dj_incremental', 'dj_delta_baseline'):
+            job = self.env['dj.burn.job'].create_for(
+                self.comp, options={'dj_exclude_core': True,
+                                    'dj_burn_workers': 2,
+                                    option: True})
+            with patch.object(BurnProgress, '_update'), \
+                    patch.object(self.env.cr, 'commit'), \
+                    patch.object(self.env.cr, 'rollback'), \
+                    patch(BURN_SONGS_PATH) as burn_songs:
+                job.with_context(dj_read_skip_special_fields=True)._run()
+            # workers would not store tracks nor baselines
+            self.assertEqual(job.state, 'failed')
+            self.assertIn('parallel workers', job.error)
+            burn_songs.assert_not_called()
+
+    def test_cron_recover_stale(self):
+        jobs = self.env['dj.burn.job']
+        for date_start in ('2000-01-01 00:00:00', '2000-01-01 00:00:00',
+                           fields.Datetime.now()):
+            job = jobs.create_for(self.comp)
+            job.write({'state': 'running', 'date_start': date_start})
+            jobs |= job
+        stale, alive, recent = jobs
+        # the process burning `alive` holds its lock
+        with self.registry.cursor() as cr:
+            cr.execute('SELECT pg_advisory_lock(%s, %s)',
+                       (BURN_JOB_LOCK_KEY, alive.id))
+            try:
+                with patch.object(self.env.cr, 'commit'):
+                    jobs._cron_run()
+            finally:
+                cr.execute('SELECT pg_advisory_unlock(%s, %s)',
+                           (BURN_JOB_LOCK_KEY, alive.id))
+        jobs.invalidate_cache()
+        self.assertEqual(jobs.mapped('state'),
+                         ['failed', 'running', 'running'])
+        self.assertTrue(stale.error)
+
+    def test_job_cancel(self):
+        job = self.env['dj.burn.job'].create_for(self.comp)
+        job.action_cancel()
+        self.assertEqual(job.state, 'cancelled')
+        job = self.env['dj.burn.job'].create_for(self.comp)
+        job.state = 'running'
+        job.action_cancel()
+        self.assertEqual(job.state, 'running')
+        self.assertTrue(job.cancel_requested)
@@ -2,13 +2,18 @@
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html)
 
 from . common import BaseCompilationCase
+import io
+import os
+import tempfile
+import zipfile
 try:
     from unittest.mock import patch
 except ImportError:
     from mock import patch
 
-DJ_COMPILATION_MODEL_PATH = \
-    'odoo.addons.base_dj.models.dj.dj_compilation.Compilation'
+DJ_COMPILATION_MODULE_PATH = 'odoo.addons.base_dj.models.dj.dj_compilation'
+DJ_COMPILATION_MODEL_PATH = DJ_COMPILATION_MODULE_PATH + '.Compilation'
+DJ_SONG_MODULE_PATH = 'odoo.addons.base_dj.models.dj.dj_song'
 
 
 class CompilationCase(BaseCompilationCase):
@@ -51,6 +56,81 @@ class CompilationCase(BaseCompilationCase):
             'songs/bar_baz.py'
         )
 
+    def test_download_url(self):
+        genre = self.env.ref('base_dj.test_genre')
+        comp = self.env['dj.compilation'].create({
+            'name': 'Foo',
+            'genre_id': genre.id,
+        })
+        # burn state is not propagated
+        comp = comp.with_context(
+            dj_exclude_core=1, dj_id_sets=True, dj_layouts={})
+        self.assertEqual(
+            comp.download_url,
+            '/dj/download/compilation/%d?dj_exclude_core=1' % comp.id)
+
+    def test_layout(self):
+        genre = self.env.ref('base_dj.test_genre')
+        comp = self.env['dj.compilation'].create({
+            'name': 'Foo',
+            'genre_id': genre.id,
+        })
+        partner_model = self.env.ref('base.model_res_partner')
+        company_model = self.env.ref('base.model_res_company')
+        for seq, model in ((10, partner_model),
+                           (20, company_model),
+                           (30, partner_model)):
+            self.env['dj.song'].create({
+                'compilation_id': comp.id,
+                'model_id': model.id,
+                'sequence': seq,
+            })
+        song1, song2, song3 = comp.song_ids
+        self.assertEqual(
+            comp.song_ids.mapped('position_in_collection'), [1, 2, 3])
+        # songs sharing model and type are numbered
+        self.assertEqual(
+            comp.song_ids.mapped('name'),
+            ['load_res_partner_1', 'load_res_company', 'load_res_partner_3'])
+        self.assertEqual(
+            song3.real_csv_path(),
+            'install/generated/dj_test/foo/res.partner_3.csv')
+        self.assertEqual(
+            song2.real_binaries_path(),
+            'install/generated/dj_test/foo/binaries/res.company')
+        self.assertEqual(
+            song1.anthem_path(),
+            'songs.install.generated.dj_test.foo::load_res_partner_1')
+        self.assertEqual(
+            comp.anthem_path(), 'songs.install.generated.dj_test.foo::main')
+        # computed once per burn
+        layouts = {}
+        comp = comp.with_context(dj_layouts=layouts)
+        self.assertIs(comp.dj_layout(), comp.dj_layout())
+        self.assertEqual(list(layouts), [comp.id])
+
+    def test_prepare_xmlids_batches(self):
+        self._load_xml('base_dj', 'tests/fixtures/fixture_comp1.xml')
+        comp = self.env.ref('base_dj.test_comp1')
+        songs = comp._get_all_songs()
+        song = self.env.ref('base_dj.test_song2')
+        users = song._get_exportable_records()
+        with patch(DJ_SONG_MODULE_PATH + '.EXPORT_BATCH_SIZE', 2):
+            xmlid_records = song._get_xmlid_records()
+            self.assertEqual(xmlid_records['res.users'], set(users.ids))
+            self.assertTrue(
+                set(users.mapped('company_id').ids) <=
+                xmlid_records['res.company'])
+            comp._prepare_xmlids(songs)
+        # all exported and related records have an xmlid now
+        for song in songs:
+            for model, ids in song._get_xmlid_records().items():
+                records = self.env[model].browse(ids)
+                if not records._is_an_ordinary_table():
+                    continue
+                self.assertFalse(records.filtered(
+                    lambda x: not x.get_external_id().get(x.id)), model)
+
     def test_burn_and_test1(self):
         fixture = 'fixture_comp1'
         expected_path = 'songs/install/generated/dj_test/comp1.py'
@@ -61,6 +141,12 @@ class CompilationCase(BaseCompilationCase):
         expected_path = 'songs/install/generated/dj_test/comp4.py'
         self._burn_and_test(fixture, expected_path, 'base_dj.test_comp4')
 
+    def test_burn_generate_xmlids(self):
+        fixture = 'fixture_xmlids'
+        expected_path = 'songs/install/generated/dj_test/comp_xmlids.py'
+        self._burn_and_test(
+            fixture, expected_path, 'base_dj.test_comp_xmlids')
+
     def test_burn_contents(self):
         tracks = self.burn_contents()
         paths = sorted([x[0] for x in tracks])
@@ -112,3 +198,182 @@ class CompilationCase(BaseCompilationCase):
         init_content_list = [x[1] for x in tracks if '__init__.py' in x[0]]
         for init_content in init_content_list:
             self.assertEqual(init_content, '#\n')
+
+    def test_burn_incremental(self):
+        fixture = 'fixture_comp1'
+        self._load_xml('base_dj', 'tests/fixtures/%s.xml' % fixture)
+        comp = self.env.ref('base_dj.test_comp1').with_context(
+            dj_read_skip_special_fields=True,
+            dj_incremental=True,
+        )
+        summary = {'reused': [], 'burnt': []}
+        tracks = comp.with_context(
+            dj_burn_summary=summary).get_all_tracks(include_core=False)
+        self.assertFalse(summary['reused'])
+        self.assertEqual(len(summary['burnt']), len(comp.song_ids))
+        self.assertTrue(all(comp.song_ids.mapped('burn_fingerprint')))
+        # nothing changed: all the songs are reused
+        summary = {'reused': [], 'burnt': []}
+        tracks2 = comp.with_context(
+            dj_burn_summary=summary).get_all_tracks(include_core=False)
+        self.assertEqual(len(summary['reused']), len(comp.song_ids))
+        to_bytes = (
+            lambda x: x.encode('utf-8') if isinstance(x, str) else x)
+        self.assertEqual(
+            [(path, to_bytes(data)) for path, data in tracks],
+            [(path, to_bytes(data)) for path, data in tracks2],
+        )
+        # partners changed: their song is burnt again
+        song = comp.song_ids.filtered(
+            lambda x: x.model_name == 'res.partner')
+        self.env['res.partner'].create({'name': 'New partner'})
+        summary = {'reused': [], 'burnt': []}
+        comp.with_context(
+            dj_burn_summary=summary).get_all_tracks(include_core=False)
+        self.assertEqual(summary['burnt'], [song])
+        # related record changed: users are burnt again
+        users_song = comp.song_ids.filtered(
+            lambda x: x.model_name == 'res.users')
+        company = self.env.ref('base.main_company')
+        self.env.cr.execute("""
+            UPDATE res_company SET write_date = write_date + interval '1h'
+            WHERE id = %s
+        """, (company.id, ))
+        summary = {'reused': [], 'burnt': []}
+        comp.with_context(
+            dj_burn_summary=summary).get_all_tracks(include_core=False)
+        self.assertIn(users_song, summary['burnt'])
+        # new xmlid of a related record: burnt again too
+        self.env['ir.model.data'].create({
+            'module': '__dj_test__',
+            'name': 'company_alias',
+            'model': 'res.company',
+            'res_id': company.id,
+        })
+        summary = {'reused': [], 'burnt': []}
+        comp.with_context(
+            dj_burn_summary=summary).get_all_tracks(include_core=False)
+        self.assertIn(users_song, summary['burnt'])
+
+    def test_burn_track_cache(self):
+        fixture = 'fixture_comp1'
+        self._load_xml('base_dj', 'tests/fixtures/%s.xml' % fixture)
+        comp = self.env.ref('base_dj.test_comp1').with_context(
+            dj_read_skip_special_fields=True,
+            dj_track_cache=True,
+        )
+        cache = self.env['dj.track.cache']
+        tracks = comp.get_all_tracks(include_core=False)
+        entries = cache.search([])
+        self.assertTrue(entries)
+        self.assertFalse(any(entries.mapped('hit_count')))
+        tracks2 = comp.get_all_tracks(include_core=False)
+        self.assertEqual(cache.search([]), entries)
+        self.assertTrue(all(entries.mapped('hit_count')))
+        to_bytes = (
+            lambda x: x.encode('utf-8') if isinstance(x, str) else x)
+        self.assertEqual(
+            [(path, to_bytes(data)) for path, data in tracks],
+            [(path, to_bytes(data)) for path, data in tracks2],
+        )
+        stats = self.env['dj.track.cache.stats'].create({})
+        self.assertEqual(stats.misses, len(entries))
+        self.assertEqual(stats.hit_rate, 50.0)
+        # least recently used entries are evicted first
+        self.env['ir.config_parameter'].sudo().set_param(
+            'base_dj.track_cache_max_size', entries[0].size)
+        cache._evict()
+        self.assertEqual(cache.search([]), entries[0])
+        stats.action_clear()
+        self.assertFalse(cache.search([]))
+        # storing a key twice (eg: concurrent burns) keeps the first tracks
+        cache.store('dup', [('a.csv', b'1')])
+        self.assertEqual(cache.store('dup', [('a.csv', b'2')]),
+                         [('a.csv', b'2')])
+        self.assertEqual(cache.get_tracks('dup'), [('a.csv', b'1')])
+
+    def test_burn_to_file(self):
+        fixture = 'fixture_comp1'
+        self._load_xml('base_dj', 'tests/fixtures/%s.xml' % fixture)
+        comp = self.env.ref('base_dj.test_comp1').with_context(
+            dj_read_skip_special_fields=True)
+        with tempfile.TemporaryFile() as fp:
+            filename = comp.burn_to_file(fp)
+            self.assertEqual(filename, comp.make_album_title())
+            with zipfile.ZipFile(fp) as zf:
+                names = zf.namelist()
+        self.assertIn(comp.disc_full_path(), names)
+        filename2, content = comp.burn()
+        self.assertEqual(filename2, filename)
+        self.assertTrue(zipfile.is_zipfile(io.BytesIO(content)))
+
+    def test_burn_to_directory(self):
+        fixture = 'fixture_comp1'
+        self._load_xml('base_dj', 'tests/fixtures/%s.xml' % fixture)
+        comp = self.env.ref('base_dj.test_comp1').with_context(
+            dj_read_skip_special_fields=True)
+        with tempfile.TemporaryDirectory() as root:
+            report = comp.burn_to_directory(root)
+            self.assertIn(comp.disc_full_path(), report['added'])
+            self.assertFalse(report['changed'])
+            # hand written songs are never pruned
+            custom = os.path.join(root, 'songs', 'install', 'custom.py')
+            with open(custom, 'w') as fd:
+                fd.write('# custom\n')
+            report = comp.burn_to_directory(root, prune=True)
+            self.assertEqual(
+                report, {'added': [], 'changed': [], 'removed': []})
+            self.assertTrue(os.path.exists(custom))
+
+    def test_burn_wiz_attachment(self):
+        fixture = 'fixture_comp1'
+        self._load_xml('base_dj', 'tests/fixtures/%s.xml' % fixture)
+        comp = self.env.ref('base_dj.test_comp1')
+        wiz = self.env['dj.compilation.burn.wiz'].with_context(
+            dj_read_skip_special_fields=True,
+        ).create({
+            'compilation_id': comp.id,
+            'dj_force_data_mode': comp.data_mode,
+            'dj_exclude_core': True,
+        })
+        wiz.action_burn()
+        attachment = wiz.download_attachment_id
+        self.assertTrue(attachment)
+        self.assertEqual(attachment.mimetype, 'application/zip')
+        self.assertEqual(
+            wiz.download_url, '/dj/download/attachment/%d' % attachment.id)
+        with attachment.dj_open() as fp:
+            content = fp.read()
+        self.assertEqual(attachment.file_size, len(content))
+        with zipfile.ZipFile(io.BytesIO(content)) as zf:
+            self.assertIn(comp.disc_full_path(), zf.namelist())
+        wiz.unlink()
+        self.assertFalse(attachment.exists())
+
+    def test_template_registry(self):
+        genre = self.env.ref('base_dj.test_genre')
+        comp = self.env['dj.compilation'].create({
+            'name': 'Foo',
+            'genre_id': genre.id,
+        })
+        # compiled once, then reused
+        self.assertIs(comp.dj_template(), comp.dj_template())
+        with self.assertRaises(LookupError):
+            comp.dj_template(path='base_dj:discs/nope.tmpl')
+
+    def test_burn_disc_autopep8(self):
+        fixture = 'fixture_comp1'
+        self._load_xml('base_dj', 'tests/fixtures/%s.xml' % fixture)
+        comp = self.env.ref('base_dj.test_comp1')
+        path, content = comp.burn_disc()
+        comp = comp.with_context(dj_autopep8=True)
+        # autopep8 is optional: discs are kept as they are w/out it
+        with patch(DJ_COMPILATION_MODULE_PATH + '.autopep8', None):
+            self.assertEqual(comp.burn_disc(), (path, content))
+        fixed = 'fixed\n'
+        with patch(DJ_COMPILATION_MODULE_PATH + '.autopep8') as autopep8:
+            autopep8.fix_code.return_value = fixed
+            self.assertEqual(comp.burn_disc(), (path, fixed))
+            # same content: not fixed again
+            self.assertEqual(comp.burn_disc(), (path, fixed))
+        autopep8.fix_code.assert_called_once_with(content)
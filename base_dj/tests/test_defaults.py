@@ -67,3 +67,11 @@ class DefaultsSongCase(BaseCase):
         expected = self.main_partner.id
         record.invalidate_cache()
         self.assertEqual(record.json_value, json.dumps(expected))
+
+    def test_xmlid_value_records(self):
+        """Verify that referenced records get xmlids before burning."""
+        record = self._get_default_record('dj.test.defaults', 'partner_id')
+        self.assertEqual(
+            record._dj_xmlid_value_records(['field_id', 'json_value']),
+            {'res.partner': {self.main_partner.id}})
+        self.assertFalse(record._dj_xmlid_value_records(['field_id']))
@@ -1,8 +1,20 @@
 # Copyright 2017 Camptocamp SA
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html)
 
+import io
+import os
+import tempfile
+
 from . common import BaseCase
-from ..config import SPECIAL_FIELDS
+from odoo.exceptions import UserError
+from ..config import SPECIAL_FIELDS, ID_SET_REF
+from ..utils import write_csv, materialize_tracks
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+DJ_SONG_MODULE_PATH = 'odoo.addons.base_dj.models.dj.dj_song'
 
 
 class SongCase(BaseCase):
@@ -63,6 +75,59 @@ class SongCase(BaseCase):
         # thanks to a specific equalizer for users `admin` should be excluded
         self.assertEqual(len(records), len(all_records) - 1)
 
+    def test_get_records_id_set(self):
+        """Big lists of IDs are searched via sub-selects."""
+        song = self.env.ref('base_dj.test_song1_partner_category')
+        all_records = self.env['res.partner.category'].search([])
+        # pad w/ missing IDs to go over the threshold
+        ids = all_records.ids + list(range(10 ** 6, 10 ** 6 + 1000))
+        song.domain = str([('id', 'in', ids)])
+        id_sets = self.env['dj.id.set']
+        # no set is stored outside burns
+        domain = song.eval_domain()
+        self.assertEqual(domain[0][1], 'inselect')
+        self.assertEqual(song._get_exportable_records(), all_records)
+        self.assertFalse(id_sets.search([]))
+        # stored domain is untouched
+        self.assertEqual(song.domain, str([('id', 'in', ids)]))
+        # while burning sets are stored once
+        song = song.with_context(dj_id_sets=True)
+        self.assertEqual(song._get_exportable_records(), all_records)
+        self.assertEqual(song._get_exportable_records(), all_records)
+        self.assertEqual(len(id_sets.search([])), 1)
+        set_id = id_sets.store(song.model_name, ids)
+        self.assertEqual(id_sets.search([]).id, set_id)
+        # blacklisting
+        domain = id_sets.with_context(dj_id_sets=True).expand_domain(
+            song.model_name, [('id', 'not in', ids)])
+        self.assertIn('dj_id_set_item', domain[0][2][0])
+        self.assertFalse(self.env['res.partner.category'].search(domain))
+
+    def test_get_records_id_set_reference(self):
+        """Songs' domains refer to big sets of IDs by key."""
+        song = self.env.ref('base_dj.test_song1_partner_category')
+        all_records = self.env['res.partner.category'].search([])
+        ids = all_records.ids + list(range(10 ** 6, 10 ** 6 + 1000))
+        id_sets = self.env['dj.id.set']
+        # small lists are kept
+        self.assertEqual(
+            id_sets.reference(song.model_name, all_records.ids),
+            sorted(all_records.ids))
+        ref = id_sets.reference(song.model_name, ids)
+        self.assertTrue(ref.startswith(ID_SET_REF))
+        song.domain = str([('id', 'in', ref)])
+        self.assertEqual(song._get_exportable_records(), all_records)
+        # referred sets survive garbage collection, unused ones don't
+        id_sets.store(song.model_name, ids[1:])
+        self.env.cr.execute("UPDATE dj_id_set SET last_used = '2000-01-01'")
+        id_sets._gc()
+        self.assertEqual(
+            id_sets.search([]).mapped('key'), [ref[len(ID_SET_REF):]])
+        # dangling references are reported
+        song.domain = str([('id', 'in', ID_SET_REF + '0' * 32)])
+        with self.assertRaises(UserError):
+            song.eval_domain()
+
     def test_make_csv(self):
         """Record blacklisted via equalizer."""
         song = self.env.ref('base_dj.test_song1_partner_category')
@@ -70,3 +135,203 @@ class SongCase(BaseCase):
         # TODO: check results, we are just testing that it does not break ATM
         self.assertTrue(path)
         self.assertTrue(content)
+
+    def test_make_csv_batches(self):
+        song = self.env.ref('base_dj.test_song1_partner_category')
+        path, content = song.make_csv()
+        # same output when exporting records by small batches
+        with patch(DJ_SONG_MODULE_PATH + '.EXPORT_BATCH_SIZE', 2):
+            path, batched = song.make_csv()
+        self.assertEqual(batched, content)
+
+    def test_make_csv_sql(self):
+        banks = self.env['res.bank'].create([{
+            'name': 'Bank "quoted", w/ comma',
+            'street': 'Line 1\r\nLine 2^MLine 3\nLine 4',
+            'bic': 'ABCDEF12',
+            'country': self.env.ref('base.ch').id,
+        }, {
+            'name': 'Inactive bank',
+            'active': False,
+        }, {
+            'name': 'Bänk ünicode',
+            'city': '',
+        }])
+        song = self.env['dj.song'].create({
+            'compilation_id': self.env.ref('base_dj.test_comp2').id,
+            'model_id': self.env.ref('base.model_res_bank').id,
+            'domain': "[('id', 'in', %s)]" % banks.ids,
+        })
+        field_names = song.get_csv_field_names()
+        model = self.env['res.bank'].with_context(
+            **song._dj_export_context())
+        self.assertTrue(model._dj_export_sql_supported(field_names))
+        path, content = song.make_csv()
+        # same output as the ORM
+        fp = io.BytesIO()
+        write_csv(fp, field_names, song._csv_rows(
+            song._get_exportable_records(), field_names))
+        self.assertEqual(content, fp.getvalue())
+        # header + records + line feeds in the street
+        self.assertEqual(
+            len(content.splitlines()),
+            1 + len(song._get_exportable_records()) + 3)
+
+    def test_make_csv_sql_unsupported(self):
+        song = self.env.ref('base_dj.test_song1_partner_category')
+        model = song.song_model.with_context(**song._dj_export_context())
+        # translatable name
+        self.assertFalse(
+            model._dj_export_sql_supported(song.get_csv_field_names()))
+        self.assertFalse(
+            self.env['res.bank']._dj_export_sql_supported(['id', 'country']))
+
+    def test_burn_translation_tracks(self):
+        self.env['res.lang'].load_lang('fr_FR')
+        song = self.env.ref('base_dj.test_song1_partner_category')
+        song.export_translations = True
+        category = self.env['res.partner.category'].create({
+            'name': 'Translated',
+        })
+        category.with_context(lang='fr_FR').name = 'Traduit'
+        tracks = song.burn_translation_tracks()
+        # same tracks as translation shadow songs
+        shadows = song.compilation_id._add_shadow_song_translations(song)
+        expected = []
+        for shadow in shadows:
+            expected.extend(shadow.burn_track())
+        self.assertEqual(tracks, expected)
+        contents = dict(tracks)
+        fr_path = [x for x in contents if x.endswith('.fr_FR.csv')][0]
+        self.assertIn(b'"Traduit"', contents[fr_path])
+
+    def test_burn_translation_tracks_files(self):
+        self.env['res.lang'].load_lang('fr_FR')
+        song = self.env.ref('base_dj.test_song1_partner_category')
+        song.export_translations = True
+        files = []
+        spooled = tempfile.SpooledTemporaryFile
+
+        def make_file(*args, **kw):
+            files.append(spooled(*args, **kw))
+            return files[-1]
+
+        to_patch = DJ_SONG_MODULE_PATH + '.tempfile.SpooledTemporaryFile'
+        with patch(to_patch, side_effect=make_file):
+            tracks = song.burn_translation_tracks(lazy=True)
+        # lazy tracks own their files until written
+        self.assertTrue(files)
+        self.assertFalse(any(fp.closed for fp in files))
+        materialize_tracks(tracks)
+        self.assertTrue(all(fp.closed for fp in files))
+        # files are closed when burning fails
+        del files[:]
+        with patch(to_patch, side_effect=make_file), \
+                patch.object(type(song), '_write_translation_csvs',
+                             side_effect=ValueError):
+            with self.assertRaises(ValueError):
+                song.burn_translation_tracks()
+        self.assertTrue(files)
+        self.assertTrue(all(fp.closed for fp in files))
+
+    def test_burn_delta(self):
+        song = self.env.ref('base_dj.test_song1_partner_category')
+        model = self.env['res.partner.category']
+        cat1 = model.create({'name': 'Delta 1'})
+        cat2 = model.create({'name': 'Delta 2'})
+        song.with_context(dj_delta_baseline=True).burn_track()
+        manifest = song._get_delta_manifest()
+        self.assertIn(str(cat1.id), manifest['xmlids'])
+        cat2_xmlid = manifest['xmlids'][str(cat2.id)]
+        cat2.unlink()
+        tracks = dict(song.with_context(dj_delta=True).burn_track())
+        # nothing changed after the baseline in this transaction
+        self.assertEqual(
+            tracks[song.real_csv_path()].splitlines(),
+            [b'"id","name","parent_id/id"'])
+        # deleted records are listed
+        tombstones = tracks[song.real_tombstones_path()]
+        self.assertEqual(
+            tombstones.splitlines(),
+            [b'"id"', '"{}"'.format(cat2_xmlid).encode()])
+        # explicit date: no tombstones
+        tracks = dict(song.with_context(
+            dj_delta_since='2000-01-01 00:00:00').burn_track())
+        self.assertIn(b'Delta 1', tracks[song.real_csv_path()])
+        self.assertNotIn(song.real_tombstones_path(), tracks)
+
+    def test_burn_delta_baseline_batches(self):
+        song = self.env.ref('base_dj.test_song1_partner_category')
+        model = self.env['res.partner.category']
+        for i in range(3):
+            model.create({'name': 'Baseline {}'.format(i)})
+        sizes = []
+        export_xmlids = type(model)._dj_export_xmlids
+
+        def count_xmlids(records):
+            sizes.append(len(records))
+            return export_xmlids(records)
+
+        with patch(DJ_SONG_MODULE_PATH + '.EXPORT_BATCH_SIZE', 2), \
+                patch.object(type(model), '_dj_export_xmlids',
+                             autospec=True, side_effect=count_xmlids):
+            song._store_delta_baseline()
+        records = song._get_exportable_records()
+        self.assertEqual(sum(sizes), len(records))
+        self.assertEqual(max(sizes), 2)
+        manifest = song._get_delta_manifest()
+        self.assertEqual(
+            sorted(manifest['xmlids']), sorted(map(str, records.ids)))
+
+    def test_burn_delta_manifest_once(self):
+        song = self.env.ref('base_dj.test_song1_partner_category')
+        song.with_context(dj_delta_baseline=True).burn_track()
+        manifests = {}
+        song = song.with_context(dj_delta=True, dj_delta_manifests=manifests)
+        manifest = song._get_delta_manifest()
+        self.assertIs(manifests[song.id], manifest)
+        self.assertIs(song._get_delta_manifest(), manifest)
+
+    def test_burn_delta_translations(self):
+        self.env['res.lang'].load_lang('fr_FR')
+        song = self.env.ref('base_dj.test_song1_partner_category')
+        song.export_translations = True
+        category = self.env['res.partner.category'].create({
+            'name': 'Translated',
+        })
+        category.with_context(lang='fr_FR').name = 'Traduit'
+        self.env.cr.execute("""
+            UPDATE res_partner_category SET write_date = '2000-01-01'
+            WHERE id = %s
+        """, (category.id, ))
+        song = song.with_context(dj_delta_since='2001-01-01 00:00:00')
+        # only the translation changed
+        self.assertEqual(song._get_delta_records(category), category)
+        song.export_translations = False
+        self.assertFalse(song._get_delta_records(category))
+
+    def test_apply_tombstones(self):
+        model = self.env['res.partner.category']
+        cat = model.create({'name': 'Tombstone'})
+        xmlid = cat._dj_export_xmlid()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with open(os.path.join(tmpdir, 'tombstones.csv'), 'w') as fd:
+                fd.write('"id"\n"{}"\n'.format(xmlid))
+            with patch(
+                    'odoo.addons.base_dj.models.base.ODOO_DATA_PATH', tmpdir):
+                model._dj_apply_tombstones('tombstones.csv')
+        self.assertFalse(cat.exists())
+
+    def test_write_csv(self):
+        song = self.env.ref('base_dj.test_song1_partner_category')
+        path, content = song.make_csv()
+        fp = io.BytesIO()
+        song.write_csv(fp)
+        self.assertEqual(fp.getvalue(), content)
+        self.assertNotIn(b'\r\n', content)
+        # lazy track: content is written on demand
+        lazy_path, writer = song.burn_track(lazy=True)[0]
+        self.assertEqual(lazy_path, path)
+        fp = io.BytesIO()
+        writer(fp)
+        self.assertEqual(fp.getvalue(), song.burn_track()[0][1])
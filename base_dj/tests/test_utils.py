@@ -0,0 +1,120 @@
+# Copyright 2017 Camptocamp SA
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html)
+
+from odoo.tests.common import BaseCase
+from ..utils import create_zipfile, zip_compression, write_tree
+import os
+import tempfile
+import zipfile
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+UTILS_MODULE_PATH = 'odoo.addons.base_dj.utils'
+
+
+class UtilsCase(BaseCase):
+
+    def test_zip_compression(self):
+        self.assertEqual(
+            zip_compression('binaries/foo.PNG')[0], zipfile.ZIP_STORED)
+        self.assertEqual(
+            zip_compression('binaries/foo.tiff')[0], zipfile.ZIP_STORED)
+        self.assertEqual(
+            zip_compression('binaries/foo.svg')[0], zipfile.ZIP_DEFLATED)
+        policy = {'.csv': (zipfile.ZIP_DEFLATED, 9)}
+        with patch(UTILS_MODULE_PATH + '.ZIP_COMPRESS_LEVEL', True):
+            self.assertEqual(
+                zip_compression('data/foo.csv'), (zipfile.ZIP_DEFLATED, 6))
+            self.assertEqual(
+                zip_compression('data/foo.csv', policy=policy),
+                (zipfile.ZIP_DEFLATED, 9))
+        # levels need py >= 3.7: compress types are kept anyway
+        with patch(UTILS_MODULE_PATH + '.ZIP_COMPRESS_LEVEL', False):
+            self.assertEqual(
+                zip_compression('data/foo.csv', policy=policy),
+                (zipfile.ZIP_DEFLATED, None))
+            self.assertEqual(
+                zip_compression('binaries/foo.png'),
+                (zipfile.ZIP_STORED, None))
+
+    def test_create_zipfile(self):
+        image = b'\x89PNG' + os.urandom(1024)
+        files = [
+            ('songs/disc.py', 'print("hello")\n' * 100),
+            ('data/foo.csv', lambda fp: fp.write(b'"foo","bar"\n' * 100)),
+            ('data/binaries/foo.png', image),
+        ] + [
+            ('data/{}.csv'.format(i), b'"id"\n' * i) for i in range(20)
+        ]
+        zf = zipfile.ZipFile(create_zipfile(files))
+        self.assertIsNone(zf.testzip())
+        # written in the same order
+        self.assertEqual(zf.namelist(), [x[0] for x in files])
+        types = {x.filename: x.compress_type for x in zf.infolist()}
+        self.assertEqual(types['data/binaries/foo.png'], zipfile.ZIP_STORED)
+        self.assertEqual(types['songs/disc.py'], zipfile.ZIP_DEFLATED)
+        self.assertEqual(zf.read('data/binaries/foo.png'), image)
+        self.assertEqual(zf.read('data/19.csv'), b'"id"\n' * 19)
+
+    def test_create_zipfile_py35(self):
+        """No streaming nor compression levels before py 3.6/3.7."""
+        image = b'\x89PNG' + os.urandom(1024)
+        files = [
+            ('data/foo.csv', lambda fp: fp.write(b'"foo","bar"\n' * 100)),
+            ('data/binaries/foo.png', image),
+        ]
+        with patch(UTILS_MODULE_PATH + '.ZIP_STREAM_WRITE', False), \
+                patch(UTILS_MODULE_PATH + '.ZIP_COMPRESS_LEVEL', False):
+            zf = zipfile.ZipFile(create_zipfile(files))
+        self.assertIsNone(zf.testzip())
+        types = {x.filename: x.compress_type for x in zf.infolist()}
+        self.assertEqual(types['data/foo.csv'], zipfile.ZIP_DEFLATED)
+        self.assertEqual(types['data/binaries/foo.png'], zipfile.ZIP_STORED)
+        self.assertEqual(zf.read('data/foo.csv'), b'"foo","bar"\n' * 100)
+
+    def test_write_tree(self):
+        files = [
+            ('songs/disc.py', 'print("hello")\n'),
+            ('data/foo.csv', lambda fp: fp.write(b'"foo"\n')),
+            ('data/old.csv', '"old"\n'),
+        ]
+        manifest = '.dj/disc.manifest'
+        with tempfile.TemporaryDirectory() as root:
+            report = write_tree(root, files, manifest=manifest)
+            self.assertEqual(
+                report['added'],
+                ['data/foo.csv', 'data/old.csv', 'songs/disc.py'])
+            disc_path = os.path.join(root, 'songs/disc.py')
+            mtime = os.stat(disc_path).st_mtime_ns
+            # files not written by this burn are never touched
+            for path in ('data/other.csv', 'songs/custom.py'):
+                with open(os.path.join(root, path), 'w') as fd:
+                    fd.write('other')
+            files[1] = ('data/foo.csv', lambda fp: fp.write(b'"bar"\n'))
+            del files[2]
+            report = write_tree(root, files, manifest=manifest)
+            self.assertEqual(report, {
+                'added': [],
+                'changed': ['data/foo.csv'],
+                'removed': ['data/old.csv'],
+            })
+            self.assertEqual(os.stat(disc_path).st_mtime_ns, mtime)
+            self.assertTrue(os.path.exists(os.path.join(root, 'data/old.csv')))
+            # stale files are kept in the manifest until pruned
+            report = write_tree(root, files, manifest=manifest, prune=True)
+            self.assertEqual(report['removed'], ['data/old.csv'])
+            self.assertFalse(report['changed'])
+            self.assertFalse(
+                os.path.exists(os.path.join(root, 'data/old.csv')))
+            for path in ('data/other.csv', 'songs/custom.py'):
+                self.assertTrue(os.path.exists(os.path.join(root, path)))
+            report = write_tree(root, files, manifest=manifest, prune=True)
+            self.assertFalse(report['removed'])
+            # w/o manifest nothing is removed
+            report = write_tree(root, files[:1], prune=True)
+            self.assertFalse(report['removed'])
+            self.assertTrue(os.path.exists(os.path.join(root, 'data/foo.csv')))
+            with self.assertRaises(ValueError):
+                write_tree(root, [('../foo.py', '')])
@@ -1,7 +1,9 @@
 # Copyright 2017 Camptocamp SA
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html)
 
+from odoo.exceptions import UserError, ValidationError
 from . common import BaseCase
+from ..xmlid import base62, ShortHashIndex, XMLIDResolver
 
 
 class XMLIDCase(BaseCase):
@@ -71,6 +73,12 @@ class XMLIDCase(BaseCase):
             '__setup__.res_partner_bank_%d_[0-9a-f]{8}' % rec.id
         )
 
+    def test_xmlid_no_specific_rule_stable(self):
+        rec = self._create_partner_bank(acc_number='01235')
+        rec = rec.with_context(dj_xmlid_skip_create=True)
+        # xids are not stored but we get always the same one
+        self.assertEqual(rec._dj_export_xmlid(), rec._dj_export_xmlid())
+
     def test_xmlid_no_specific_rule_name_field(self):
         rec = self.env['res.bank'].create({'name': 'C2C Investments Ltd.', })
         # normalized name
@@ -145,6 +153,85 @@ class XMLIDCase(BaseCase):
             '__setup__.res_partner_bank_{}'.format(hashed)
         )
 
+    def test_xmlid_short_hash_policy(self):
+        self.env['dj.equalizer'].create({
+            'model': 'res.partner.bank',
+            'xmlid_fields': 'acc_number',
+            'xmlid_policy': 'short_hash',
+            'xmlid_hash_length': 6,
+        })
+        rec = self._create_partner_bank(acc_number='56789')
+        hashed = base62(
+            self.env['res.partner.bank']._hash_them((rec.acc_number, )))
+        self.assertEqual(
+            rec._dj_export_xmlid(),
+            '__setup__.res_partner_bank_{}'.format(hashed[:6])
+        )
+
+    def test_xmlid_short_hash_collision(self):
+        index = ShortHashIndex()
+        digest1 = 'a' * 32
+        digest2 = 'a' * 31 + 'b'
+        short1 = index.shorten('res.partner', 'foo_', digest1, 4)
+        short2 = index.shorten('res.partner', 'foo_', digest2, 4)
+        self.assertEqual(len(short1), 4)
+        # same prefix: grown until it differs
+        self.assertTrue(len(short2) > 4)
+        self.assertNotEqual(short1, short2)
+        # same digest gets always the same hash
+        self.assertEqual(
+            index.shorten('res.partner', 'foo_', digest1, 4), short1)
+        # other prefixes do not collide
+        self.assertEqual(
+            index.shorten('res.partner', 'bar_', digest2, 4), short2[:4])
+
+    def test_xmlid_migrate_hash(self):
+        equalizer = self.env['dj.equalizer'].create({
+            'model': 'res.partner.bank',
+            'xmlid_fields': 'acc_number',
+            'xmlid_policy': 'hash',
+        })
+        rec = self._create_partner_bank(acc_number='56789')
+        long_xid = rec._dj_export_xmlid()
+        equalizer.xmlid_policy = 'short_hash'
+        self.assertEqual(equalizer.migrate_hash_xmlids(), 1)
+        short_xid = rec._dj_export_xmlid()
+        self.assertNotEqual(short_xid, long_xid)
+        self.assertEqual(self.env.ref(short_xid), rec)
+
+    def test_equalizer_registry(self):
+        equalizer = self.env['dj.equalizer'].create({
+            'model': 'res.partner.bank',
+            'xmlid_fields': 'acc_number',
+        })
+        model = self.env['res.partner.bank']
+        conf = model._dj_global_config()
+        self.assertEqual(conf['xmlid_fields'], ['acc_number'])
+        # we get copies
+        conf['xmlid_fields'].append('foo')
+        self.assertEqual(
+            model._dj_global_config('xmlid_fields'), ['acc_number'])
+        # changes are reflected right away
+        equalizer.xmlid_fields = 'acc_number,bank_id'
+        self.assertEqual(
+            model._dj_global_config('xmlid_fields'),
+            ['acc_number', 'bank_id'])
+        equalizer.unlink()
+        self.assertEqual(model._dj_global_config('xmlid_fields'), [])
+
+    def test_equalizer_stale_record_blacklist(self):
+        self.env['dj.equalizer'].create({
+            'model': 'res.partner.bank',
+            'record_blacklist': 'base.main_partner,base.dj_gone,no_module',
+        })
+        # stale xmlids are skipped, other models' config still works
+        self.assertEqual(
+            self.env['res.partner.bank']._dj_global_config(
+                'record_blacklist'),
+            [self.env.ref('base.main_partner').id])
+        self.assertTrue(
+            self.env['res.company']._dj_global_config('xmlid_fields'))
+
     def test_xmlid_force_no_replace(self):
         rec = self.env.ref('base.main_company')
         ctx = {
@@ -210,3 +297,100 @@ class XMLIDCase(BaseCase):
             str(err.exception),
             'External ID not found in the system: __sample__.company_rok'
         )
+
+    def test_xmlid_names_batch(self):
+        recs = self._create_partner_bank(acc_number='40000')
+        recs |= self._create_partner_bank(acc_number='40001')
+        recs |= self._create_partner_bank(
+            acc_number='40002',
+            company_id=self.env.ref('base_dj.test_company_foo').id,
+        )
+        fmap = {'res.partner.bank': ['acc_number', 'company_id.name']}
+        recs = recs.with_context(dj_xmlid_fields_map=fmap, dj_multicompany=1)
+        names = recs._dj_xmlid_export_names()
+        self.assertEqual(names, {
+            recs[0].id: 'djc_res_partner_bank_40000_yourcompany',
+            recs[1].id: 'djc_res_partner_bank_40001_yourcompany',
+            recs[2].id: 'foo_res_partner_bank_40002_foo_inc',
+        })
+        # names are stable
+        self.assertEqual(recs._dj_xmlid_export_names(), names)
+
+    def test_xmlid_resolver(self):
+        resolver = XMLIDResolver(self.env.cr)
+        foo = self.env.ref('base_dj.test_company_foo')
+        baz = self.env.ref('base_dj.test_company_baz')
+        resolver.preload(['res.company'])
+        # preloaded: hits only
+        self.assertEqual(resolver.lookup(foo | baz), {
+            foo.id: ('base_dj', 'test_company_foo'),
+            baz.id: ('base_dj', 'test_company_baz'),
+        })
+        self.assertEqual((resolver.lookups, resolver.misses), (2, 0))
+        # not preloaded: looked up only once
+        bank = self.env['res.bank'].create({'name': 'Resolver Bank'})
+        self.assertEqual(resolver.lookup(bank), {})
+        self.assertEqual(resolver.misses, 1)
+        self.assertEqual(resolver.lookup(bank), {})
+        self.assertEqual(resolver.misses, 1)
+        # new xmlids are registered
+        resolver.update('res.bank', {bank.id: ('__setup__', 'res_bank_rb')})
+        self.assertEqual(
+            resolver.lookup(bank), {bank.id: ('__setup__', 'res_bank_rb')})
+        self.assertEqual((resolver.lookups, resolver.hits), (5, 4))
+
+    def test_xmlid_resolver_names_eviction(self):
+        resolver = XMLIDResolver(self.env.cr, names_cache_size=2)
+        banks = self.env['res.bank'].create({'name': 'Bank A'})
+        banks |= self.env['res.bank'].create({'name': 'Bank B'})
+        banks |= self.env['res.bank'].create({'name': 'Bank C'})
+        banks = banks.with_context(dj_xid_resolver=resolver)
+        expected = {
+            banks[0].id: 'res_bank_bank_a',
+            banks[1].id: 'res_bank_bank_b',
+            banks[2].id: 'res_bank_bank_c',
+        }
+        self.assertEqual(banks._dj_xmlid_export_names(), expected)
+        # oldest names are evicted
+        self.assertEqual(len(resolver.names), 2)
+        # and generated again when needed
+        self.assertEqual(banks._dj_xmlid_export_names(), expected)
+        self.assertEqual(banks[0]._dj_xmlid_export_names(),
+                         {banks[0].id: 'res_bank_bank_a'})
+        self.assertEqual(len(resolver.names), 2)
+
+    def test_xmlid_readonly(self):
+        rec = self.env['res.bank'].create({'name': 'Readonly Bank'})
+        # parallel burn workers refuse to create missing xmlids
+        with self.assertRaises(UserError):
+            rec.with_context(dj_xmlid_readonly=True)._dj_export_xmlid()
+        xid = rec._dj_export_xmlid()
+        self.assertEqual(
+            rec.with_context(dj_xmlid_readonly=True)._dj_export_xmlid(), xid)
+
+    def test_xmlid_conflict_fail(self):
+        banks = self.env['res.bank'].create({'name': 'Dup Bank'})
+        banks |= self.env['res.bank'].create({'name': 'Dup Bank'})
+        with self.assertRaises(ValidationError):
+            banks._dj_export_xmlids()
+
+    def test_xmlid_conflict_suffix(self):
+        banks = self.env['res.bank'].create({'name': 'Dup Bank'})
+        banks |= self.env['res.bank'].create({'name': 'Dup Bank'})
+        banks = banks.with_context(dj_xmlid_conflict='suffix')
+        self.assertEqual(banks._dj_export_xmlids(), [
+            '__setup__.res_bank_dup_bank',
+            '__setup__.res_bank_dup_bank_2',
+        ])
+        # dates are set as by the ORM: burn fingerprints rely on them
+        xids = self.env['ir.model.data'].search([
+            ('model', '=', 'res.bank'), ('res_id', 'in', banks.ids)])
+        self.assertEqual(len(xids), 2)
+        self.assertTrue(all(xids.mapped('write_date')))
+        self.assertTrue(all(xids.mapped('date_init')))
+        # existing xmlids are taken into account too
+        bank = self.env['res.bank'].create({'name': 'Dup Bank'})
+        self.assertEqual(
+            bank.with_context(dj_xmlid_conflict='suffix')._dj_export_xmlid(),
+            '__setup__.res_bank_dup_bank_3',
+        )
@@ -3,9 +3,20 @@
 # pylint: disable=W0104
 
 from .slugifier import slugify
+from .config import (
+    ZIP_COMPRESSION,
+    ZIP_COMPRESSION_DEFAULT,
+    SPOOL_MAX_SIZE,
+)
 
 import odoo
+import hashlib
 import io
+import mimetypes
+import os
+import shutil
+import sys
+import tempfile
 import zipfile
 import time
 import datetime
@@ -30,24 +41,197 @@ except NameError:
     basestring = str
 
 
-def create_zipfile(files):
-    in_mem_zip = io.BytesIO()
-    with zipfile.ZipFile(in_mem_zip, "w", zipfile.ZIP_DEFLATED) as zf:
+# zip entries can be written as streams only since py 3.6
+ZIP_STREAM_WRITE = sys.version_info >= (3, 6)
+# compression level per entry only since py 3.7
+ZIP_COMPRESS_LEVEL = sys.version_info >= (3, 7)
+
+
+def zip_compression(filepath, policy=None):
+    """Return zip compression `(compress type, level)` for `filepath`.
+
+    See `config.ZIP_COMPRESSION`. Levels need py >= 3.7:
+    before that the level is always None, ie: zlib's default one.
+    """
+    compress_type, level = _zip_policy_lookup(filepath, policy)
+    if not ZIP_COMPRESS_LEVEL:
+        level = None
+    return compress_type, level
+
+
+def _zip_policy_lookup(filepath, policy=None):
+    """Look up by extension, then by mimetype and main mimetype."""
+    policy = ZIP_COMPRESSION if policy is None else policy
+    ext = os.path.splitext(filepath)[1].lower()
+    if ext in policy:
+        return policy[ext]
+    mimetype = mimetypes.guess_type(filepath)[0]
+    if mimetype:
+        for key in (mimetype, mimetype.split('/')[0]):
+            if key in policy:
+                return policy[key]
+    return ZIP_COMPRESSION_DEFAULT
+
+
+def create_zipfile(files, fileobj=None, policy=None):
+    """Create a zip file in memory or into `fileobj`.
+
+    :param files: list of tuples `(path, data)`.
+        `data` can be a callable accepting a binary file object:
+        content is then streamed straight into the zip entry.
+    :param fileobj: binary file object to write the zip into.
+    :param policy: compression by file type, see `zip_compression`.
+        Compression levels are applied only to entries not streamed.
+        Entries are streamed w/ py >= 3.6 only.
+    :return: the file object positioned at its beginning.
+    """
+    in_mem_zip = fileobj if fileobj is not None else io.BytesIO()
+    with zipfile.ZipFile(
+            in_mem_zip, "w", zipfile.ZIP_DEFLATED, allowZip64=True) as zf:
         for filepath, data in files:
-            # File "/usr/lib/python2.7/zipfile.py", line 1247, in writestr
-            # TypeError: 'unicode' does not have the buffer interface
-            if isinstance(data, str):
-                data = data.encode('utf-8')
             # use info to keep date and set permissions
             info = zipfile.ZipInfo(
                 filepath, date_time=time.localtime(time.time()))
             # set proper permissions
             info.external_attr = 0o644 << 16
-            zf.writestr(info, data)
+            info.compress_type, level = zip_compression(filepath, policy)
+            if callable(data):
+                if ZIP_STREAM_WRITE:
+                    # size is unknown: entries may exceed 2GB
+                    with zf.open(info, 'w', force_zip64=True) as fp:
+                        data(fp)
+                    continue
+                fp = io.BytesIO()
+                data(fp)
+                data = fp.getvalue()
+            # File "/usr/lib/python2.7/zipfile.py", line 1247, in writestr
+            # TypeError: 'unicode' does not have the buffer interface
+            if isinstance(data, str):
+                data = data.encode('utf-8')
+            if level is not None:
+                zf.writestr(info, data, compresslevel=level)
+            else:
+                zf.writestr(info, data)
     in_mem_zip.seek(0)
     return in_mem_zip
 
 
+def _file_digest(fp, chunk_size=1024 * 1024):
+    digest = hashlib.md5()
+    for chunk in iter(lambda: fp.read(chunk_size), b''):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _read_manifest(path):
+    if not os.path.isfile(path):
+        return set()
+    with open(path) as fd:
+        return set(x for x in fd.read().splitlines() if x)
+
+
+def write_tree(root, files, manifest=None, prune=False):
+    """Write files into `root` directory touching only changed ones.
+
+    Each file is compared w/ the one on disk via its content hash.
+    Changed files are written to a temporary file replacing them.
+
+    :param files: list of tuples `(path, data)` as for `create_zipfile`.
+    :param manifest: path of the file listing the files burnt
+        by previous burns, relative to `root`. Files listed there
+        and not burnt anymore are reported as removed.
+        Other files are never touched: other compilations
+        and hand written songs live there too.
+    :param prune: delete removed files.
+        If not set they stay in the manifest to be pruned later.
+    :return: dictionary `{'added': [], 'changed': [], 'removed': []}`
+        of paths relative to `root`.
+    """
+    root = os.path.abspath(root)
+    report = {'added': [], 'changed': [], 'removed': []}
+    written = set()
+    for filepath, data in files:
+        target = os.path.normpath(os.path.join(root, filepath))
+        if not target.startswith(root + os.sep):
+            raise ValueError('Path outside of target directory: %s' % filepath)
+        written.add(os.path.relpath(target, root))
+        with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) as fp:
+            if callable(data):
+                data(fp)
+            else:
+                if isinstance(data, str):
+                    data = data.encode('utf-8')
+                fp.write(data)
+            fp.seek(0)
+            digest = _file_digest(fp)
+            exists = os.path.isfile(target)
+            if exists:
+                with open(target, 'rb') as current:
+                    if _file_digest(current) == digest:
+                        continue
+            fp.seek(0)
+            _replace_file(target, fp)
+        report['changed' if exists else 'added'].append(
+            os.path.relpath(target, root))
+    if manifest:
+        manifest = os.path.join(root, manifest)
+        previous = _read_manifest(manifest)
+        for path in sorted(previous - written):
+            target = os.path.join(root, path)
+            if not os.path.isfile(target):
+                continue
+            report['removed'].append(path)
+            if prune:
+                os.unlink(target)
+        listed = written
+        if not prune:
+            listed = written | set(report['removed'])
+        content = ''.join(x + '\n' for x in sorted(listed))
+        _replace_file(manifest, io.BytesIO(content.encode('utf-8')))
+    for key in report:
+        report[key].sort()
+    return report
+
+
+def _replace_file(target, fp):
+    """Write `target` atomically w/ the content of `fp`."""
+    dirname = os.path.dirname(target)
+    os.makedirs(dirname, exist_ok=True)
+    with tempfile.NamedTemporaryFile(
+            dir=dirname, prefix='.dj_', delete=False) as tmp:
+        shutil.copyfileobj(fp, tmp)
+    os.chmod(tmp.name, 0o644)
+    os.replace(tmp.name, target)
+
+
+def copy_and_close(fp, out):
+    """Copy `fp` into `out` then close `fp`.
+
+    For lazy tracks owning their temporary file.
+    """
+    try:
+        shutil.copyfileobj(fp, out)
+    finally:
+        fp.close()
+
+
+def materialize_tracks(tracks):
+    """Return `tracks` w/ their content as bytes.
+
+    :param tracks: list of tuples `(path, data)` as for `create_zipfile`.
+    """
+    res = []
+    for path, data in tracks:
+        if callable(data):
+            fp = io.BytesIO()
+            data(fp)
+            data = fp.getvalue()
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        res.append((path, data))
+    return res
+
+
 def make_title(name):
     dt = datetime.datetime.now().strftime('%Y%m%d_%H%M')
     return '{}-{}.zip'.format(slugify(name).replace('-', '_'), dt)
@@ -56,23 +240,74 @@ def make_title(name):
 def csv_from_data(fields, rows):
     """Prepare data for CSV."""
     fp = io.BytesIO()
-    writer = csv.writer(fp, quoting=csv.QUOTE_ALL, encoding='utf-8')
-    writer.writerow(fields)
-    for data in rows:
-        row = []
-        for i, col in enumerate(data):
-            if col is False:
-                col = None
-            row.append(col)
-        # writer.writerow([to_str(x, safe=True) for x in row])
-        writer.writerow(row)
-
-    fp.seek(0)
-    data = fp.read()
+    write_csv(fp, fields, rows)
+    data = fp.getvalue()
     fp.close()
     return data
 
 
+def write_csv(fp, fields, rows, chunk_size=500):
+    """Stream CSV data to a binary file object.
+
+    Rows are encoded and flushed to `fp` by chunks
+    hence memory usage does not depend on the number of rows.
+    Line endings are always `\\n`.
+
+    :param fp: a binary file object (a file, a zip entry...)
+    :param fields: header columns. No header is written if `None`
+    :param rows: iterable of rows
+    :param chunk_size: number of rows to buffer before writing
+    """
+    buf = io.BytesIO()
+    writer = csv.writer(
+        buf, quoting=csv.QUOTE_ALL, encoding='utf-8', lineterminator='\n')
+
+    def flush():
+        # all values are quoted: a row always ends w/ `"\n`
+        # hence we can cleanup line endings chunk by chunk.
+        fp.write(clean_csv_line_endings(buf.getvalue()))
+        buf.seek(0)
+        buf.truncate()
+
+    if fields is not None:
+        writer.writerow(fields)
+    for i, data in enumerate(rows, 1):
+        writer.writerow([None if col is False else col for col in data])
+        if not i % chunk_size:
+            flush()
+    flush()
+
+
+def clean_csv_line_endings(data):
+    """Normalize line endings of CSV bytes to `\\n`."""
+    return data.replace(b'\r\n', b'\n').replace(b'^M', b'\n')
+
+
+class CSVLineEndingsWriter(object):
+    """Wrap a binary file object to normalize CSV line endings.
+
+    Data can be written in chunks of any size:
+    the tail following the last line feed is kept until next write.
+    Call `close` to write it.
+    """
+
+    def __init__(self, fp):
+        self.fp = fp
+        self._tail = b''
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        data = self._tail + data
+        cut = data.rfind(b'\n') + 1
+        self._tail = data[cut:]
+        self.fp.write(clean_csv_line_endings(data[:cut]))
+
+    def close(self):
+        self.fp.write(clean_csv_line_endings(self._tail))
+        self._tail = b''
+
+
 @contextmanager
 def force_company(env, company_id):
     user_company = env.user.company_id
@@ -104,6 +339,21 @@ def is_xml(content):
         return False
 
 
+def pep8_call(prefix, args, indent=4, max_length=79):
+    """Return the code calling `prefix(args)`, wrapped as PEP8 expects.
+
+    Arguments go to their own line when the call is too long.
+
+    :param prefix: the code before parenthesis, eg: `model = env.foo`
+    :param args: arguments as a string
+    :param indent: indentation of the code (not included in the result)
+    """
+    line = '{}({})'.format(prefix, args)
+    if not args or indent + len(line) <= max_length:
+        return line
+    return '{}(\n{}{})'.format(prefix, ' ' * (indent + 4), args)
+
+
 def context_to_string(ctx):
     """Convert context dictionary to a string.
 
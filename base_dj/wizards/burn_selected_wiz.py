@@ -24,3 +24,10 @@ class BurnSelectedWiz(models.TransientModel):
                 ','.join([str(x) for x in self.compilation_ids.ids])
             ),
         }
+
+    @api.multi
+    def burn_them_all_job(self):
+        """Burn all the compilations in background."""
+        self.ensure_one()
+        job = self.env['dj.burn.job'].create_for(self.compilation_ids)
+        return job.get_formview_action()
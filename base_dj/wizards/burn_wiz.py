@@ -4,8 +4,10 @@
 from odoo import api, models, fields, exceptions, _
 from urllib.parse import urlencode
 import mimetypes
-import base64
 import os
+import tempfile
+
+from ..config import SPOOL_MAX_SIZE
 
 
 class BurnWiz(models.TransientModel):
@@ -61,16 +63,79 @@ class BurnWiz(models.TransientModel):
         help='Do not store newly generated XIDs',
         default=False,
     )
+    dj_xmlid_conflict = fields.Selection(
+        string='XIDs conflicts',
+        help='What to do when generated XIDs are not unique. '
+             '"Fail" stops the burn, '
+             '"Suffix" appends a counter to the XID, '
+             '"Hash" appends a short hash of the record to the XID.',
+        selection=[
+            ('fail', 'Fail'),
+            ('suffix', 'Suffix'),
+            ('hash', 'Hash'),
+        ],
+        default='fail',
+    )
+    dj_burn_workers = fields.Integer(
+        string='Workers',
+        help='Burn songs in parallel using this number of processes. '
+             'Used only by background burn jobs: missing XIDs '
+             'are committed before starting the workers.',
+    )
+    dj_incremental = fields.Boolean(
+        string='Incremental',
+        help='Reuse the tracks of songs that did not change '
+             'since their last incremental burn. '
+             'Not available w/ parallel workers.',
+    )
+    dj_delta = fields.Boolean(
+        string='Delta',
+        help='Export only records changed since the baseline '
+             'stored by the last burn w/ "Store baseline". '
+             'Deleted records are listed in a tombstones file.',
+    )
+    dj_delta_since = fields.Datetime(
+        string='Delta since',
+        help='Export only records changed since this date.',
+    )
+    dj_delta_baseline = fields.Boolean(
+        string='Store baseline',
+        help='Store exported records as baseline for next delta burns. '
+             'Not available w/ parallel workers.',
+    )
+    dj_track_cache = fields.Boolean(
+        string='Use tracks cache',
+        help='Reuse tracks burnt w/ the same inputs, '
+             'even by other compilations. Ignored by delta burns.',
+    )
+    dj_autopep8 = fields.Boolean(
+        string='Fix discs w/ autopep8',
+        help='Discs are PEP8 compliant already. '
+             'Run autopep8 on them anyway, eg: for custom templates.',
+    )
     burn_url = fields.Char(
         string='Share burn URL',
         default='',
         readonly=True,
     )
-    download_filename = fields.Char()
-    download_file = fields.Binary(
-        attachment=True,
+    download_attachment_id = fields.Many2one(
+        string='Burnt file',
+        comodel_name='ir.attachment',
         readonly=True,
     )
+    download_url = fields.Char(
+        string='Download',
+        compute='_compute_download_url',
+    )
+
+    @api.depends('download_attachment_id')
+    def _compute_download_url(self):
+        for item in self:
+            if item.download_attachment_id:
+                item.download_url = '/dj/download/attachment/{}'.format(
+                    item.download_attachment_id.id)
+            else:
+                item.download_url = False
 
     @api.onchange('compilation_id')
     def _onchange_compilation_id(self):
@@ -103,7 +168,10 @@ class BurnWiz(models.TransientModel):
         })
         self._update_url()
 
-    @api.onchange('dj_xmlid_force', 'dj_xmlid_skip_create')
+    @api.onchange('dj_xmlid_force', 'dj_xmlid_skip_create',
+                  'dj_xmlid_conflict', 'dj_burn_workers', 'dj_incremental',
+                  'dj_delta', 'dj_delta_since', 'dj_delta_baseline',
+                  'dj_track_cache', 'dj_autopep8')
     def _onchange_force_flags(self):
         self._update_url()
 
@@ -120,29 +188,44 @@ class BurnWiz(models.TransientModel):
             config=urlencode(self._get_config())
         )
 
+    @api.multi
+    def action_burn_job(self):
+        """Burn the compilation in background."""
+        self.ensure_one()
+        job = self.env['dj.burn.job'].create_for(
+            self.compilation_id, options=self._get_config())
+        return job.get_formview_action()
+
     @api.multi
     def action_burn(self):
+        """Burn and store the result to be downloaded as it is."""
         self.ensure_one()
-        if self.song_id:
-            fname, content, __ = self._burn_song()
-        else:
-            fname, content, __ = self._burn_compilation()
-        self.update({
-            'download_filename': fname,
-            'download_file': base64.b64encode(content),
-        })
+        with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) as fp:
+            if self.song_id:
+                fname, __ = self._burn_song(fp)
+            else:
+                fname, __ = self._burn_compilation(fp)
+            attachment = self.env['ir.attachment'].dj_create_from_file(fp, {
+                'name': fname,
+                'datas_fname': fname,
+                'res_model': self._name,
+                'res_id': self.id,
+            })
+        self.download_attachment_id.unlink()
+        self.download_attachment_id = attachment
         return {
             "type": "ir.actions.do_nothing",
         }
 
-    def _burn_compilation(self):
+    def _burn_compilation(self, fileobj):
         ctx = self.env['dj.compilation'].make_burn_ctx_via_params(
             **self._get_config()
         )
-        filename, content = self.compilation_id.with_context(**ctx).burn()
-        return filename, content, 'application/zip'
+        filename = self.compilation_id.with_context(**ctx).burn_to_file(
+            fileobj)
+        return filename, 'application/zip'
 
-    def _burn_song(self):
+    def _burn_song(self, fileobj):
         ctx = self.env['dj.compilation'].make_burn_ctx_via_params(
             **self._get_config()
         )
@@ -150,6 +233,14 @@ class BurnWiz(models.TransientModel):
         if not track:
             raise exceptions.UserError(_('Sorry, nothing to burn here.'))
         path, content = track[0]
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        fileobj.write(content)
         filename = os.path.basename(path)
         ctype = mimetypes.guess_type(filename)[0] or 'text/csv'
-        return filename, content, ctype
+        return filename, ctype
+
+    @api.multi
+    def unlink(self):
+        self.mapped('download_attachment_id').unlink()
+        return super().unlink()
@@ -0,0 +1,330 @@
+# Copyright 2017 Camptocamp SA
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl)
+
+from collections import defaultdict
+import hashlib
+import logging
+import string
+
+from odoo.tools.lru import LRU
+
+_logger = logging.getLogger(__name__)
+
+BASE62 = string.digits + string.ascii_letters
+
+
+def base62(hexdigest):
+    """Encode an hex digest in base 62: a md5 digest takes 22 chars."""
+    num = int(hexdigest, 16)
+    res = ''
+    while num:
+        num, rem = divmod(num, 62)
+        res = BASE62[rem] + res
+    return res or BASE62[0]
+
+
+class ShortHashIndex(object):
+    """Keep truncated hashes unique per model.
+
+    A short hash is grown only when the same name
+    has been given already to a different digest.
+    """
+
+    def __init__(self):
+        # {model: {name: full digest}}
+        self._index = defaultdict(dict)
+
+    def shorten(self, model, prefix, hexdigest, length):
+        """Return the shortest unique hash of at least `length` chars.
+
+        :param prefix: the name part preceding the hash
+        :param hexdigest: the full hex digest to shorten
+        """
+        full = base62(hexdigest)
+        index = self._index[model]
+        length = max(length, 1)
+        while True:
+            short = full[:length]
+            owner = index.setdefault(prefix + short, full)
+            if owner == full or length >= len(full):
+                return short
+            length += 1
+
+
+class XMLIDResolver(object):
+    """Resolve records' xmlids from memory during a whole burn.
+
+    Existing xmlids are loaded in bulk for each model
+    referenced by the songs to burn. Models that were not preloaded
+    are looked up on demand and the result is kept for the next lookups.
+
+    Newly generated xmlids must be registered via `update`
+    to keep the resolver in sync w/ `ir_model_data`.
+    """
+
+    def __init__(self, cr, names_cache_size=100000):
+        self.cr = cr
+        # generated xmlid names {(model, res_id, settings): name}
+        self.names = LRU(names_cache_size)
+        # {model: {res_id: (module, name)}}
+        self._xids = defaultdict(dict)
+        # {model: set(res_id)} ids already looked up
+        self._checked = defaultdict(set)
+        # models whose xmlids are all in memory
+        self._loaded = set()
+        # short hashes given by `short_hash` xmlid policy
+        self.short_hashes = ShortHashIndex()
+        self.lookups = 0
+        self.misses = 0
+        # xmlids conflict reports collected during the burn
+        self.reports = []
+
+    @property
+    def hits(self):
+        return self.lookups - self.misses
+
+    def preload(self, model_names):
+        """Load all the existing xmlids for given models in one query."""
+        todo = set(model_names) - self._loaded
+        if not todo:
+            return
+        # sort by id: when a record has more than one xmlid
+        # we get always the same one (the latest).
+        self.cr.execute("""
+            SELECT model, res_id, module, name
+            FROM ir_model_data
+            WHERE model IN %s
+            ORDER BY id
+        """, (tuple(sorted(todo)), ))
+        for model, res_id, module, name in self.cr.fetchall():
+            self._xids[model][res_id] = (module, name)
+        self._loaded.update(todo)
+
+    def lookup(self, records):
+        """Return existing xmlids as `{res_id: (module, name)}`.
+
+        Same output as `Base._existing_xids`.
+        """
+        model = records._name
+        ids = records.ids
+        if model not in self._loaded:
+            checked = self._checked[model]
+            todo = [x for x in set(ids) if x not in checked]
+            if todo:
+                self.misses += len(todo)
+                self._fetch(model, todo)
+                checked.update(todo)
+        self.lookups += len(ids)
+        known = self._xids[model]
+        return {
+            res_id: known[res_id]
+            for res_id in ids if res_id in known
+        }
+
+    def _fetch(self, model, ids):
+        self.cr.execute("""
+            SELECT res_id, module, name
+            FROM ir_model_data
+            WHERE model = %s AND res_id IN %s
+            ORDER BY id
+        """, (model, tuple(ids)))
+        known = self._xids[model]
+        for res_id, module, name in self.cr.fetchall():
+            known[res_id] = (module, name)
+
+    def update(self, model, xids):
+        """Register new xmlids for `model`.
+
+        :param xids: dictionary `{res_id: (module, name)}`
+        """
+        self._xids[model].update(xids)
+        self._checked[model].update(xids.keys())
+
+    def log_stats(self):
+        _logger.info(
+            'XMLID resolver: %d lookups, %d hits, %d misses. '
+            'Preloaded models: %s',
+            self.lookups, self.hits, self.misses,
+            ', '.join(sorted(self._loaded)) or '-'
+        )
+        if self.reports:
+            _logger.warning(
+                'XMLID conflicts resolved for: %s',
+                ', '.join(sorted(set(x.model for x in self.reports))))
+
+
+class XMLIDConflictError(Exception):
+    """Raised when xmlids collide and we are asked to fail."""
+
+    def __init__(self, report):
+        super().__init__(str(report))
+        self.report = report
+
+
+class XMLIDConflictReport(object):
+    """Collect xmlids collisions found while writing them."""
+
+    def __init__(self, model, module):
+        self.model = model
+        self.module = module
+        # [{'res_id': 1, 'name': 'foo', 'reason': 'duplicate',
+        #   'resolved': 'foo_2'}, ...]
+        self.conflicts = []
+
+    def add(self, res_id, name, reason, resolved=None):
+        self.conflicts.append({
+            'res_id': res_id,
+            'name': name,
+            'reason': reason,
+            'resolved': resolved,
+        })
+
+    def __bool__(self):
+        return bool(self.conflicts)
+
+    def __str__(self):
+        lines = ['XMLID conflicts for %s (module `%s`):' % (
+            self.model, self.module)]
+        for item in self.conflicts:
+            line = '  * ID %(res_id)d: `%(name)s` (%(reason)s)' % item
+            if item['resolved']:
+                line += ' -> `%s`' % item['resolved']
+            lines.append(line)
+        return '\n'.join(lines)
+
+
+class XMLIDWriter(object):
+    """Store xmlids in bounded chunks handling name collisions.
+
+    Collisions are looked up in memory (same name for many records)
+    and against existing `ir_model_data` rows before writing.
+    Each collision is handled via `strategy`:
+
+    * `fail`: nothing is written and `XMLIDConflictError` is raised
+    * `suffix`: a numeric suffix is appended to the name (`foo_2`)
+    * `hash`: a short hash of model and record ID is appended to the name
+    """
+
+    strategies = ('fail', 'suffix', 'hash')
+
+    def __init__(self, cr, strategy='fail', chunk_size=1000):
+        if strategy not in self.strategies:
+            raise ValueError('Unknown xmlid conflict strategy: %s' % strategy)
+        self.cr = cr
+        self.strategy = strategy
+        self.chunk_size = chunk_size
+
+    def write(self, model, module, names):
+        """Store xmlids for given records.
+
+        :param model: model name
+        :param module: xmlid module name
+        :param names: dictionary `{res_id: name}`
+        :return: tuple (`{res_id: name}` w/ final names, conflict report)
+        """
+        report = XMLIDConflictReport(model, module)
+        # {name: (model, res_id)} names already taken
+        self._owners = self._existing_owners(module, set(names.values()))
+        in_batch = set()
+        result = {}
+        pending = {}
+        # sort them to always keep the name for the same record
+        for res_id in sorted(names):
+            name = names[res_id]
+            owner = self._owners.get(name)
+            if owner == (model, res_id):
+                # already there
+                result[res_id] = name
+                continue
+            if owner is None:
+                self._owners[name] = (model, res_id)
+                in_batch.add(name)
+                pending[res_id] = name
+                continue
+            reason = 'duplicate' if name in in_batch else 'existing'
+            pending[res_id] = self._resolve(
+                report, model, module, res_id, name, reason)
+        if report and self.strategy == 'fail':
+            raise XMLIDConflictError(report)
+        while pending:
+            written = self._insert(model, module, pending)
+            result.update(written)
+            # rows not written have been taken in the meantime
+            pending = {
+                res_id: self._resolve(
+                    report, model, module, res_id, name, 'concurrent')
+                for res_id, name in pending.items() if res_id not in written
+            }
+            if report and self.strategy == 'fail':
+                raise XMLIDConflictError(report)
+        return result, report
+
+    def _existing_owners(self, module, names):
+        owners = {}
+        names = sorted(names)
+        for i in range(0, len(names), self.chunk_size):
+            self.cr.execute("""
+                SELECT name, model, res_id
+                FROM ir_model_data
+                WHERE module = %s AND name IN %s
+            """, (module, tuple(names[i:i + self.chunk_size])))
+            for name, model, res_id in self.cr.fetchall():
+                owners[name] = (model, res_id)
+        return owners
+
+    def _is_free(self, module, name):
+        if name in self._owners:
+            return False
+        self.cr.execute("""
+            SELECT model, res_id
+            FROM ir_model_data
+            WHERE module = %s AND name = %s
+        """, (module, name))
+        row = self.cr.fetchone()
+        if row:
+            self._owners[name] = tuple(row)
+        return not row
+
+    def _resolve(self, report, model, module, res_id, name, reason):
+        """Find a new name for `res_id` according to current strategy."""
+        resolved = None
+        base = name
+        if self.strategy == 'hash':
+            digest = hashlib.md5(
+                '{},{}'.format(model, res_id).encode()).hexdigest()[:8]
+            base = '{}_{}'.format(name, digest)
+            if self._is_free(module, base):
+                resolved = base
+        if self.strategy != 'fail' and not resolved:
+            count = 2
+            while not self._is_free(module, '{}_{}'.format(base, count)):
+                count += 1
+            resolved = '{}_{}'.format(base, count)
+        report.add(res_id, name, reason, resolved=resolved)
+        if resolved:
+            self._owners[resolved] = (model, res_id)
+        return resolved
+
+    def _insert(self, model, module, names):
+        """Insert xmlids and return the ones actually written."""
+        written = {}
+        # dates are set as the ORM would: burn fingerprints rely on them
+        self.cr.execute("SELECT now() at time zone 'UTC'")
+        now = self.cr.fetchone()[0]
+        rows = [
+            (module, model, name, res_id, now, now, now, now)
+            for res_id, name in sorted(names.items())
+        ]
+        for i in range(0, len(rows), self.chunk_size):
+            chunk = rows[i:i + self.chunk_size]
+            query = """
+                INSERT INTO ir_model_data
+                    (module, model, name, res_id,
+                     date_init, date_update, create_date, write_date)
+                VALUES {}
+                ON CONFLICT DO NOTHING
+                RETURNING res_id, name
+            """.format(', '.join(['%s'] * len(chunk)))
+            self.cr.execute(query, chunk)
+            written.update(self.cr.fetchall())
+        return written